@@ -0,0 +1,300 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+"""Throughput and latency benchmarks of the freedesktop (plat_other) backend.
+
+Every scenario trashes into a private trash directory created under the
+target, through the same TrashBatch code path as ``send2trash()``; the user's
+trash is never touched. Scenarios:
+
+- small_files: many files of a few KiB
+- huge_file: one large file (a rename, unless it crosses devices)
+- deep_tree: a deeply nested directory
+- collisions: files all having the same name, exercising the name allocator
+- exdev: files and a tree moved to a trash on another device (copies)
+
+Targets are directories given as ``[NAME=]DIR`` or filesystems mounted for the
+run with ``--mount tmpfs`` / ``--mount loop`` (root only). The exdev scenario
+trashes from each target into the next one; with a single target, or targets
+on the same device, the copy is forced rather than triggered by EXDEV.
+
+Results (files per second and latency percentiles per scenario and target)
+can be saved as a baseline and later compared against it; the exit status is
+1 when a result regressed by more than ``--threshold``:
+
+    python -m benchmarks.bench_trash --mount tmpfs --mount loop --save-baseline base.json
+    python -m benchmarks.bench_trash --mount tmpfs --mount loop --baseline base.json
+"""
+
+import argparse
+import json
+import os
+import os.path as op
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+from send2trash import plat_other
+
+SCENARIOS = ["small_files", "huge_file", "deep_tree", "collisions", "exdev"]
+WRITE_CHUNK = 1024 * 1024
+
+
+class BenchCache:
+    # Stands for the TrashCache of a batch: every path goes to the bench trash
+    # and EXDEV falls back to exdev_location instead of the home trash.
+    def __init__(self, location, exdev_location=None):
+        self.location = location
+        self.exdev_location = exdev_location or location
+
+    def lookup(self, path, path_dev):
+        return self.location
+
+    def lookup_home(self):
+        return self.exdev_location
+
+    def invalidate(self, location):
+        return False
+
+
+def write_file(path, size):
+    with open(path, "wb") as f:
+        chunk = b"\0" * min(size, WRITE_CHUNK)
+        while size > 0:
+            size -= f.write(chunk[:size])
+
+
+def make_small_files(root, count):
+    paths = []
+    for index in range(count):
+        path = op.join(root, b"small_%d" % index)
+        write_file(path, index % 4096 + 1)
+        paths.append(path)
+    return paths
+
+
+def make_deep_tree(root, depth):
+    top = path = op.join(root, b"deep")
+    for level in range(depth):
+        os.mkdir(path)
+        write_file(op.join(path, b"file"), 512)
+        path = op.join(path, b"d%d" % level)
+    return top
+
+
+def make_collisions(root, count):
+    paths = []
+    for index in range(count):
+        parent = op.join(root, b"c%d" % index)
+        os.mkdir(parent)
+        path = op.join(parent, b"core.dump")
+        write_file(path, 64)
+        paths.append(path)
+    return paths
+
+
+def run_batch(paths, location, exdev_location=None, force_copy=False):
+    """Trash ``paths`` in one batch, return per path latencies and total seconds."""
+    batch = plat_other.TrashBatch(cache=BenchCache(location, exdev_location))
+    latencies = []
+    start = time.perf_counter()
+    with batch:
+        for path in paths:
+            item_start = time.perf_counter()
+            if force_copy:
+                [item] = batch.plan([path])
+                if item.error is not None:
+                    raise item.error
+                batch.move_item(item, exdev_location, cross_dev=True)
+            else:
+                batch.trash(path)
+            latencies.append(time.perf_counter() - item_start)
+    return latencies, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, seconds):
+    values = sorted(latencies)
+    return {
+        "items": len(values),
+        "seconds": seconds,
+        "files_per_second": len(values) / seconds if seconds else 0.0,
+        "mean_ms": statistics.mean(values) * 1000,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p90_ms": percentile(values, 0.90) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+@contextmanager
+def workspace(target):
+    # Source files and a private trash, both removed afterwards
+    root = os.fsencode(tempfile.mkdtemp(prefix="s2t_bench", dir=target))
+    try:
+        yield root
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def new_location(root, name=b"trash"):
+    plat_other.name_allocator.clear()
+    return plat_other.TrashLocation(op.join(root, name), root, 0)
+
+
+def run_scenario(name, target, other, args):
+    latencies = []
+    seconds = 0.0
+    for _ in range(args.repeat):
+        with workspace(target) as root, ExitStack() as stack:
+            location = new_location(root)
+            exdev_location = None
+            force_copy = False
+            if name == "small_files":
+                paths = make_small_files(root, args.files)
+            elif name == "huge_file":
+                paths = [op.join(root, b"huge")]
+                write_file(paths[0], args.huge_size)
+            elif name == "deep_tree":
+                paths = [make_deep_tree(root, args.depth)]
+            elif name == "collisions":
+                paths = make_collisions(root, args.files)
+            elif name == "exdev":
+                paths = make_small_files(root, max(1, args.files // 10)) + [make_deep_tree(root, 16)]
+                other_root = stack.enter_context(workspace(other))
+                exdev_location = new_location(other_root)
+                force_copy = os.stat(root).st_dev == os.stat(other_root).st_dev
+            run_latencies, run_seconds = run_batch(paths, location, exdev_location, force_copy)
+            latencies.extend(run_latencies)
+            seconds += run_seconds
+    result = summarize(latencies, seconds)
+    if name == "exdev" and force_copy:
+        result["forced_copy"] = True
+    return result
+
+
+@contextmanager
+def mounted(kind, size):
+    if os.geteuid() != 0:
+        raise SystemExit("--mount needs root, pass existing directories with --target instead")
+    mount_point = tempfile.mkdtemp(prefix="s2t_bench_" + kind)
+    image = None
+    try:
+        if kind == "tmpfs":
+            subprocess.run(["mount", "-t", "tmpfs", "-o", "size=%d" % size, "tmpfs", mount_point], check=True)
+        else:
+            fd, image = tempfile.mkstemp(prefix="s2t_bench", suffix=".img")
+            os.close(fd)
+            os.truncate(image, size)
+            subprocess.run(["mkfs.ext4", "-q", "-F", image], check=True)
+            subprocess.run(["mount", "-o", "loop", image, mount_point], check=True)
+        try:
+            yield mount_point
+        finally:
+            subprocess.run(["umount", mount_point], check=True)
+    finally:
+        os.rmdir(mount_point)
+        if image is not None:
+            os.remove(image)
+
+
+def parse_target(value):
+    name, sep, path = value.partition("=")
+    if not sep:
+        name, path = value, value
+    return name, path
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each result against ``baseline``, return the regressions."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        throughput = result["files_per_second"] / base["files_per_second"] if base["files_per_second"] else 1.0
+        p99 = result["p99_ms"] / base["p99_ms"] if base["p99_ms"] else 1.0
+        regressed = throughput < 1 - threshold or p99 > 1 + threshold
+        if regressed:
+            regressions.append(key)
+        print(
+            "%-28s files/s %+6.1f%%  p99 %+6.1f%%%s"
+            % (key, (throughput - 1) * 100, (p99 - 1) * 100, "  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def print_results(results):
+    print(
+        "%-28s %8s %12s %9s %9s %9s %9s"
+        % ("scenario@target", "items", "files/s", "p50 ms", "p90 ms", "p99 ms", "max ms")
+    )
+    for key, result in sorted(results.items()):
+        print(
+            "%-28s %8d %12.1f %9.3f %9.3f %9.3f %9.3f"
+            % (
+                key + (" *" if result.get("forced_copy") else ""),
+                result["items"],
+                result["files_per_second"],
+                result["p50_ms"],
+                result["p90_ms"],
+                result["p99_ms"],
+                result["max_ms"],
+            )
+        )
+    if any(result.get("forced_copy") for result in results.values()):
+        print("* copy forced, the targets are on the same device")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark trashing with the freedesktop backend")
+    parser.add_argument("--target", action="append", default=[], metavar="[NAME=]DIR", help="Directory to run in")
+    parser.add_argument("--mount", action="append", default=[], choices=["tmpfs", "loop"], help="Mount a target")
+    parser.add_argument("--mount-size", type=int, default=2 * 1024**3, help="Size of mounted targets in bytes")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Scenario to run (default: all)")
+    parser.add_argument("--files", type=int, default=2000, help="Files of the small_files/collisions scenarios")
+    parser.add_argument("--huge-size", type=int, default=512 * 1024**2, help="Size of the huge file in bytes")
+    parser.add_argument("--depth", type=int, default=256, help="Depth of the deep_tree scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each scenario")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Store the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare the results with a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args(args)
+
+    with ExitStack() as stack:
+        targets = [parse_target(value) for value in args.target]
+        targets += [(kind, stack.enter_context(mounted(kind, args.mount_size))) for kind in args.mount]
+        if not targets:
+            targets = [("tmp", tempfile.gettempdir())]
+        results = {}
+        for index, (name, path) in enumerate(targets):
+            other = targets[(index + 1) % len(targets)][1]
+            for scenario in args.scenario or SCENARIOS:
+                results["%s@%s" % (scenario, name)] = run_scenario(scenario, path, other, args)
+
+    print_results(results)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,21 +4,142 @@
 # which should be included with this package. The terms are also available at
 # http://www.hardcoded.net/licenses/bsd_license
 
+import importlib
+import os
 import sys
+import threading
+from contextlib import closing
 
-from send2trash.exceptions import TrashPermissionError  # noqa: F401
+from send2trash.exceptions import SourceRemovalError, TrashPermissionError  # noqa: F401
 
 if sys.version_info[0] < 3:
     raise RuntimeError("send2trash is only compatible with Python 3 and above (use versions <= 1.8.3 for python 2).")
 
-if sys.platform == "darwin":
-    from send2trash.mac import send2trash
-elif sys.platform == "win32":
-    from send2trash.win import send2trash
-else:
-    try:
-        # If we can use gio, let's use it
-        from send2trash.plat_gio import send2trash
-    except ImportError:
-        # Oh well, let's fallback to our own Freedesktop trash implementation
-        from send2trash.plat_other import send2trash  # noqa: F401
+# Backend modules by name. The backend isn't imported with the package but on
+# the first call (importing gi alone can take hundreds of milliseconds).
+BACKENDS = {
+    "mac": "send2trash.mac",
+    "win": "send2trash.win",
+    "gio": "send2trash.plat_gio",
+    "other": "send2trash.plat_other",
+}
+# Environment variable forcing a backend, overridden by set_backend()
+BACKEND_ENV = "SEND2TRASH_BACKEND"
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def default_backends():
+    """Return the names of the backends to try on this platform, in order."""
+    if sys.platform == "darwin":
+        return ["mac"]
+    if sys.platform == "win32":
+        return ["win"]
+    # If we can use gio, let's use it, otherwise fallback to our own
+    # Freedesktop trash implementation
+    return ["gio", "other"]
+
+
+def _import_backend(names):
+    for name in names[:-1]:
+        try:
+            return importlib.import_module(BACKENDS[name])
+        except ImportError:
+            pass
+    return importlib.import_module(BACKENDS[names[-1]])
+
+
+def get_backend():
+    """Return the backend module, importing it on the first call."""
+    global _backend
+    backend = _backend
+    if backend is None:
+        with _backend_lock:
+            if _backend is None:
+                forced = os.environ.get(BACKEND_ENV)
+                if forced and forced not in BACKENDS:
+                    raise ValueError("Unknown %s %r, expected one of %s" % (BACKEND_ENV, forced, ", ".join(BACKENDS)))
+                _backend = _import_backend([forced] if forced else default_backends())
+            backend = _backend
+    return backend
+
+
+def set_backend(name=None):
+    """Pin the backend to use by name (a key of ``BACKENDS``), importing it now.
+
+    Raises ImportError if it isn't available. With None, the backend is chosen
+    again on the next call.
+    """
+    global _backend
+    with _backend_lock:
+        if name is None:
+            _backend = None
+            return None
+        if name not in BACKENDS:
+            raise ValueError("Unknown backend %r, expected one of %s" % (name, ", ".join(BACKENDS)))
+        _backend = importlib.import_module(BACKENDS[name])
+        return _backend
+
+
+def send2trash(paths, **kwargs):
+    return get_backend().send2trash(paths, **kwargs)
+
+
+def iter_send2trash(paths, jobs=None, progress=None, stop_on_error=False):
+    """Trash every path of ``paths``, not stopping at errors, yielding a
+    ``(path, error)`` pair per path in input order.
+
+    ``paths`` can be any iterable, generators included, which is consumed in
+    bounded chunks as the results are: memory use doesn't grow with the number
+    of paths. ``jobs`` bounds the paths trashed at once by the backends able
+    to trash several (worker threads for plat_other, requests in flight for
+    gio), the others trash paths one by one. With ``stop_on_error``, paths
+    are trashed one by one and the iteration ends with the first error: the
+    paths after it are left alone.
+    """
+    from send2trash.util import iter_paths
+
+    backend = get_backend()
+    if backend.__name__ == "send2trash.plat_other":
+        results = backend.iter_send2trash(paths, workers=jobs, progress=progress, stop_on_error=stop_on_error)
+    elif backend.__name__ == "send2trash.plat_gio":
+        max_in_flight = 1 if stop_on_error else jobs or backend.MAX_IN_FLIGHT
+        results = backend.iter_send2trash(
+            paths, max_in_flight=max_in_flight, progress=progress, stop_on_error=stop_on_error
+        )
+    else:
+        results = _iter_one_by_one(backend, iter_paths(paths), progress)
+    return _until_error(results) if stop_on_error else results
+
+
+def _until_error(results):
+    with closing(results):
+        for path, error in results:
+            yield path, error
+            if error is not None:
+                return
+
+
+def _iter_one_by_one(backend, paths, progress):
+    for path in paths:
+        try:
+            backend.send2trash(path, progress=progress)
+        except Exception as error:
+            yield path, error
+        else:
+            yield path, None
+
+
+def send2trash_many(paths, jobs=None, progress=None):
+    """Trash every path of ``paths``, not stopping at errors.
+
+    Returns a :class:`~send2trash.util.TrashResult` of ``(path, error)``
+    pairs. See :func:`iter_send2trash` for the arguments.
+    """
+    from send2trash.util import TrashResult
+
+    result = TrashResult()
+    for path, error in iter_send2trash(paths, jobs, progress):
+        result.add(path, error)
+    return result
@@ -7,29 +7,116 @@
 
 from __future__ import print_function
 
+import os
 import sys
+import time
 
 from argparse import ArgumentParser
-from send2trash import send2trash
+from functools import partial
+from itertools import chain
+from send2trash import iter_send2trash
+from send2trash.progress import Metrics
 
 if sys.version_info[0] < 3:
     raise RuntimeError("send2trash is only compatible with Python 3 and above (use versions <= 1.8.3 for python 2).")
 
+READ_SIZE = 65536
+
+
+def read_paths(f, separator):
+    """Yield the ``separator`` separated paths of binary file ``f`` as bytes."""
+    pending = b""
+    while True:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        parts = (pending + data).split(separator)
+        pending = parts.pop()
+        for part in parts:
+            if part:
+                yield part
+    if pending:
+        yield pending
+
+
+def read_file(path, separator):
+    with open(path, "rb") as f:
+        yield from read_paths(f, separator)
+
+
+def input_paths(args):
+    if args.from_file is None:
+        return iter(args.files)
+    separator = b"\0" if args.null else b"\n"
+    if args.from_file == "-":
+        from_file = read_paths(sys.stdin.buffer, separator)
+    else:
+        from_file = read_file(args.from_file, separator)
+    return chain(args.files, from_file)
+
+
+def print_stats(metrics, seconds):
+    data = metrics.as_dict()
+    done = data["succeeded"] + data["failed"]
+    rate = done / seconds if seconds else 0.0
+    print(
+        "%d trashed, %d failed in %.3fs (%.1f files/s)" % (data["succeeded"], data["failed"], seconds, rate),
+        file=sys.stderr,
+    )
+    if data["bytes_copied"]:
+        print("%d bytes copied across devices" % data["bytes_copied"], file=sys.stderr)
+    for phase, total in sorted(data["phase_seconds"].items()):
+        count = data["phase_counts"][phase]
+        print("  %-8s %9.3fs total %9.3fms mean" % (phase, total, total / count * 1000), file=sys.stderr)
+
 
 def main(args=None):
     parser = ArgumentParser(description="Tool to send files to trash")
-    parser.add_argument("files", nargs="+")
+    parser.add_argument("files", nargs="*")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print deleted files")
+    parser.add_argument("-f", "--from-file", metavar="FILE", help="Also trash the paths listed in FILE ('-' for stdin)")
+    parser.add_argument("-0", "--null", action="store_true", help="Paths of --from-file are NUL separated")
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Paths trashed at once with --keep-going, when the backend allows it"
+    )
+    parser.add_argument("-k", "--keep-going", action="store_true", help="Don't stop at the first error")
+    parser.add_argument("--stats", action="store_true", help="Print throughput numbers to stderr")
+    parser.add_argument("--daemon", action="store_true", help="Trash through the daemon, if one is running")
+    parser.add_argument("--serve", action="store_true", help="Run a daemon trashing paths for other processes")
+    parser.add_argument("--socket", metavar="PATH", help="Socket of the daemon")
     args = parser.parse_args(args)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.serve:
+        from send2trash import daemon
+
+        daemon.serve(args.socket, jobs=args.jobs)
+        return
+    if not args.files and args.from_file is None:
+        parser.error("the following arguments are required: files (or --from-file)")
+
+    metrics = Metrics() if args.stats else None
+    trash = iter_send2trash
+    if args.daemon:
+        from send2trash import daemon
 
-    for filename in args.files:
-        try:
-            send2trash(filename)
+        trash = partial(daemon.iter_send2trash, socket_path=args.socket)
+    start = time.monotonic()
+    # The input is streamed through the backend, which reads it in chunks.
+    # Without --keep-going, nothing after the first error is trashed.
+    results = trash(input_paths(args), jobs=args.jobs, progress=metrics, stop_on_error=not args.keep_going)
+    failed = False
+    for path, error in results:
+        if error is None:
             if args.verbose:
-                print("Trashed «" + filename + "»")
-        except OSError as e:
-            print(str(e), file=sys.stderr)
-            sys.exit(1)
+                print("Trashed «" + os.fsdecode(path) + "»")
+        else:
+            failed = True
+            print(str(error), file=sys.stderr)
+    if metrics is not None:
+        print_stats(metrics, time.monotonic() - start)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# asyncio front-end: the blocking backend calls are run in an executor so that
+# trashing (which can take seconds on network filesystems) doesn't block the
+# event loop.
+
+import asyncio
+import threading
+from collections import namedtuple
+from functools import partial
+
+from send2trash.util import iter_paths
+
+# error is None when path was trashed, the raised exception otherwise
+TrashEvent = namedtuple("TrashEvent", ["path", "error"])
+
+
+def _get_trasher(progress=None):
+    # Return (trash, finish): trash is called with each path, finish once done
+    from send2trash import get_backend
+
+    backend = get_backend()
+    if backend.__name__ == "send2trash.plat_other":
+        # Share trash lookups between all the paths of the operation
+        batch = backend.TrashBatch(progress=progress)
+        return batch.trash, batch.flush
+    return partial(backend.send2trash, progress=progress), lambda: None
+
+
+def _trash_path(trash, path, stopped):
+    # Jobs still queued in the executor when the iteration stops are skipped
+    if stopped.is_set():
+        return None
+    try:
+        trash(path)
+    except Exception as error:
+        return error
+    return None
+
+
+async def iter_send2trash(paths, concurrency=4, executor=None, progress=None):
+    """Trash ``paths``, yielding a :class:`TrashEvent` as each path completes.
+
+    At most ``concurrency`` paths are in flight in ``executor`` (the loop's
+    default executor if None). Errors don't stop the iteration, they are
+    reported in the events. Cancelling the consumer, or closing the iterator,
+    stops before the next path is started; paths already being trashed are
+    waited for, then the backend's final work (such as the directorysizes
+    update of :class:`~send2trash.plat_other.TrashBatch`) is also run in
+    ``executor``.
+
+    ``progress`` is passed on to the backend, see :mod:`send2trash.progress`;
+    it is called from the executor's threads.
+    """
+    loop = asyncio.get_running_loop()
+    trash, finish = _get_trasher(progress)
+    paths = iter_paths(paths)
+    pending = {}
+    stopped = threading.Event()
+
+    def fill():
+        while len(pending) < concurrency:
+            try:
+                path = next(paths)
+            except StopIteration:
+                return
+            pending[loop.run_in_executor(executor, _trash_path, trash, path, stopped)] = path
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield TrashEvent(pending.pop(future), future.result())
+            fill()
+    finally:
+        stopped.set()
+        if pending:
+            await asyncio.wait(pending)
+        await loop.run_in_executor(executor, finish)
+
+
+async def send2trash(paths, concurrency=4, executor=None, progress=None):
+    """Coroutine equivalent of :func:`send2trash.send2trash`.
+
+    Raises the first error encountered; no other path is started after it.
+    """
+    events = iter_send2trash(paths, concurrency=concurrency, executor=executor, progress=progress)
+    try:
+        async for event in events:
+            if event.error is not None:
+                raise event.error
+    finally:
+        await events.aclose()
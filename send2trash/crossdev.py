@@ -0,0 +1,445 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# Moving files and trees between devices, used by plat_other when a rename into
+# the trash fails with EXDEV. Data is cloned (FICLONE reflink) when the
+# filesystem allows it, otherwise copied in the kernel with copy_file_range()
+# or sendfile(), with a plain read/write loop as the last resort. Trees are
+# scanned in parallel and checked before anything is copied, then their files
+# are copied in parallel and the source is only removed once everything was
+# copied and checked.
+
+import errno
+import os
+import os.path as op
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from send2trash.exceptions import SourceRemovalError
+from send2trash.util import remove_trees, sync_filesystem
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+# Size of the chunks handed to copy_file_range()/sendfile()/read()
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Ways of copying file data, fastest first
+STRATEGIES = ("reflink", "copy_file_range", "sendfile", "read")
+
+# errnos meaning "this way of copying is not available here, try another one"
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.ETXTBSY,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}
+
+
+class CopyStats:
+    """Totals of a cross device move, safe to update from several threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # Number of files copied with each strategy
+        self.strategies = {}
+
+    def add_file(self, size, strategy):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.strategies[strategy] = self.strategies.get(strategy, 0) + 1
+
+    def add_time(self, seconds):
+        with self.lock:
+            self.seconds += seconds
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return "<CopyStats %d files, %d bytes, %.0f bytes/s>" % (self.files, self.bytes, self.bytes_per_second)
+
+
+def clone(src_fd, dst_fd):
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as error:
+        if error.errno in UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def copy_range(copy, src_fd, dst_fd, size):
+    # Returns False if copy isn't supported between these files, before
+    # anything was written.
+    offset = 0
+    while offset < size:
+        try:
+            copied = copy(src_fd, dst_fd, offset, min(CHUNK_SIZE, size - offset))
+        except OSError as error:
+            if offset == 0 and error.errno in UNSUPPORTED_ERRNOS:
+                return False
+            raise
+        if not copied:
+            break
+        offset += copied
+    return True
+
+
+def copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def read_write(src_fd, dst_fd, size):
+    while True:
+        data = os.read(src_fd, CHUNK_SIZE)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view) :]
+
+
+def copy_data(src_fd, dst_fd, size):
+    """Copy ``size`` bytes between file descriptors, return the strategy used."""
+    return copy_data_from(STRATEGIES[0], src_fd, dst_fd, size)
+
+
+def copy_data_from(first, src_fd, dst_fd, size):
+    # copy_data() skipping the strategies before first
+    skip = STRATEGIES.index(first)
+    if size and skip <= 0 and clone(src_fd, dst_fd):
+        return "reflink"
+    if size and skip <= 1 and hasattr(os, "copy_file_range") and copy_range(copy_file_range, src_fd, dst_fd, size):
+        return "copy_file_range"
+    if size and skip <= 2 and hasattr(os, "sendfile") and copy_range(sendfile, src_fd, dst_fd, size):
+        return "sendfile"
+    read_write(src_fd, dst_fd, size)
+    return "read"
+
+
+def copy_metadata(src, dst, st):
+    shutil.copystat(src, dst, follow_symlinks=False)
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    except (PermissionError, NotImplementedError):
+        pass
+
+
+def copy_file(src, dst, stats, progress=None, strategies=None):
+    # strategies maps source devices to the first strategy worth trying for
+    # their files, as learnt from the files copied before.
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            known = None if strategies is None else strategies.get(st.st_dev)
+            if known is None:
+                strategy = copy_data(src_fd, dst_fd, st.st_size)
+            else:
+                strategy = copy_data_from(known, src_fd, dst_fd, st.st_size)
+            if strategies is not None and st.st_size and strategy != known:
+                strategies[st.st_dev] = strategy
+            copied = os.fstat(dst_fd).st_size
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    if copied != st.st_size:
+        raise OSError(errno.EIO, "Incomplete copy (%d of %d bytes)" % (copied, st.st_size), dst)
+    copy_metadata(src, dst, st)
+    stats.add_file(st.st_size, strategy)
+    if progress is not None:
+        progress(st.st_size)
+
+
+def copy_special(src, dst, st):
+    if stat.S_ISLNK(st.st_mode):
+        os.symlink(os.readlink(src), dst)
+    elif stat.S_ISFIFO(st.st_mode):
+        os.mkfifo(dst, stat.S_IMODE(st.st_mode))
+    else:
+        os.mknod(dst, st.st_mode, st.st_rdev)
+    copy_metadata(src, dst, st)
+
+
+class TreeScan:
+    """Everything under a directory, as found by :func:`scan_tree`.
+
+    ``dirs`` (parents first), ``files`` and ``others`` (symlinks, fifos,
+    devices) hold ``(path, lstat)`` pairs, ``size`` is the total size of the
+    non-directories (as :func:`~send2trash.util.tree_size` counts it) and
+    ``errors`` the problems that would make moving the tree fail.
+    """
+
+    def __init__(self, root, st):
+        self.root = root
+        self.dirs = [(root, st)]
+        self.files = []
+        self.others = []
+        self.size = 0
+        self.errors = []
+
+
+def check_access(path, st):
+    # Directories are listed then emptied, files read
+    if stat.S_ISDIR(st.st_mode):
+        mode = os.R_OK | os.W_OK | os.X_OK
+    elif stat.S_ISREG(st.st_mode):
+        mode = os.R_OK
+    else:
+        return None
+    if os.access(path, mode):
+        return None
+    return PermissionError(errno.EACCES, "Permission denied", path)
+
+
+def scan_dir(path):
+    # Return (entries, errors), entries being (path, lstat, access error)
+    entries = []
+    errors = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                st = entry.stat(follow_symlinks=False)
+                error = check_access(entry.path, st)
+                if error is not None:
+                    errors.append(error)
+                entries.append((entry.path, st, error))
+    except OSError as error:
+        errors.append(error)
+    return entries, errors
+
+
+def scan_tree(root, executor):
+    """Walk the directory ``root`` with a ``scandir()`` per directory run on
+    ``executor``, return a :class:`TreeScan`."""
+    st = os.lstat(root)
+    scan = TreeScan(root, st)
+    error = check_access(root, st)
+    if error is not None:
+        scan.errors.append(error)
+        return scan
+    pending = {executor.submit(scan_dir, root)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            entries, errors = future.result()
+            scan.errors.extend(errors)
+            for path, st, error in entries:
+                if stat.S_ISDIR(st.st_mode):
+                    scan.dirs.append((path, st))
+                    if error is None:
+                        pending.add(executor.submit(scan_dir, path))
+                elif stat.S_ISREG(st.st_mode):
+                    scan.files.append((path, st))
+                    scan.size += st.st_size
+                else:
+                    scan.others.append((path, st))
+                    scan.size += st.st_size
+    return scan
+
+
+def scan_path(root, workers=None):
+    """:func:`scan_tree` on a pool of ``workers`` threads of its own."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return scan_tree(root, executor)
+
+
+def check_tree(scan, dst):
+    """Raise the first problem of ``scan``, or ENOSPC if its files don't fit
+    in the filesystem of ``dst``."""
+    if scan.errors:
+        raise scan.errors[0]
+    if not hasattr(os, "statvfs"):
+        return
+    st = os.statvfs(op.dirname(dst) or ".")
+    available = st.f_bavail * st.f_frsize
+    if scan.size > available:
+        raise OSError(errno.ENOSPC, "%d bytes to copy, %d available" % (scan.size, available), scan.root)
+
+
+def is_copied(st, dst):
+    # Metadata is copied last, a file with the source's size and mtime is done
+    try:
+        dst_st = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISREG(dst_st.st_mode) and dst_st.st_size == st.st_size and dst_st.st_mtime_ns == st.st_mtime_ns
+
+
+def prune(scan, dst):
+    # Remove from a partial copy at dst what doesn't match the source anymore
+    expected = {}
+    for path, st in scan.dirs[1:] + scan.files + scan.others:
+        parent, name = op.split(path)
+        expected.setdefault(parent, {})[name] = stat.S_ISDIR(st.st_mode)
+    for path, _ in scan.dirs:
+        names = expected.get(path, {})
+        try:
+            entries = os.scandir(dst + path[len(scan.root) :])
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with entries:
+            for entry in entries:
+                is_dir = names.get(entry.name)
+                if is_dir is None or is_dir != entry.is_dir(follow_symlinks=False):
+                    remove(entry.path)
+
+
+def copy_tree(scan, dst, executor, stats, progress=None, resume=False):
+    # Directories are created first, regular files are copied on the
+    # executor, directory metadata is copied last as the copy changes mtimes.
+    # With resume, dst is a partial copy of an earlier attempt and only what
+    # it lacks is copied.
+    root = scan.root
+    if resume:
+        prune(scan, dst)
+    for path, _ in scan.dirs:
+        try:
+            os.mkdir(dst + path[len(root) :], 0o700)
+        except FileExistsError:
+            if not resume:
+                raise
+    strategies = {}
+    futures = []
+    try:
+        for path, st in scan.files:
+            dst_path = dst + path[len(root) :]
+            if resume:
+                if is_copied(st, dst_path):
+                    continue
+                if op.lexists(dst_path):
+                    os.unlink(dst_path)
+            futures.append(executor.submit(copy_file, path, dst_path, stats, progress, strategies))
+        for path, st in scan.others:
+            dst_path = dst + path[len(root) :]
+            if resume and op.lexists(dst_path):
+                os.unlink(dst_path)
+            copy_special(path, dst_path, st)
+        for future in futures:
+            future.result()
+    except BaseException:
+        # Nothing may still be writing into dst once the caller cleans it up
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+    for path, st in reversed(scan.dirs):
+        copy_metadata(path, dst + path[len(root) :], st)
+
+
+def partial_path(partial_dir, st):
+    # Where a tree is copied to, named after the source so a retry finds it
+    name = "%d-%d" % (st.st_dev, st.st_ino)
+    return op.join(partial_dir, name.encode("ascii") if isinstance(partial_dir, bytes) else name)
+
+
+def remove(path, workers=None):
+    if not stat.S_ISDIR(os.lstat(path).st_mode):
+        os.unlink(path)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        [error] = remove_trees([path], executor)
+    if error is not None:
+        raise error
+
+
+def move(src, dst, workers=None, stats=None, progress=None, partial_dir=None, scan=None, sync=False):
+    """Move ``src`` to ``dst`` on another device, return a :class:`CopyStats`.
+
+    A tree is scanned in parallel first, and nothing is copied if part of it
+    can't be read or removed or if it doesn't fit on the destination. ``src``
+    is only removed once all of it was copied and each file's size checked;
+    if anything fails the partial copy at ``dst`` is removed and ``src`` is
+    left alone. Files of a tree are copied by ``workers`` threads, the copy
+    strategy that worked for a file being tried first for the next files of
+    the same device.
+
+    With ``partial_dir``, a directory on the device of ``dst``, a tree is
+    copied in there and only renamed to ``dst`` once complete. If the move
+    fails the partial copy is kept, and the next move of the same tree only
+    copies the files it lacks. ``scan``, a :class:`TreeScan` of a tree
+    ``src``, saves scanning it again. If ``src`` can't be fully removed once
+    copied, :class:`~send2trash.exceptions.SourceRemovalError` is raised and
+    the copy is kept. With ``sync``, the copy is flushed to disk (see
+    :func:`~send2trash.util.sync_filesystem`) before ``src`` is removed.
+    ``stats``, if given, is updated and returned instead of a new one.
+    ``progress``, if given, is called with the size of each file copied.
+    """
+    stats = CopyStats() if stats is None else stats
+    start = time.monotonic()
+    copy(src, dst, workers, stats, progress, partial_dir, scan)
+    if sync:
+        sync_filesystem(op.dirname(dst))
+    try:
+        remove(src, workers)
+    except OSError as error:
+        raise SourceRemovalError(error.errno, error.strerror, error.filename, None, dst) from error
+    stats.add_time(time.monotonic() - start)
+    return stats
+
+
+def copy(src, dst, workers=None, stats=None, progress=None, partial_dir=None, scan=None):
+    """:func:`move` without the removal of ``src``, nor the time accounting."""
+    stats = CopyStats() if stats is None else stats
+    st = os.lstat(src)
+    if stat.S_ISDIR(st.st_mode):
+        move_tree(src, dst, st, workers, stats, progress, partial_dir, scan)
+    else:
+        try:
+            if stat.S_ISREG(st.st_mode):
+                copy_file(src, dst, stats, progress)
+            else:
+                copy_special(src, dst, st)
+        except BaseException:
+            if op.lexists(dst):
+                remove(dst, workers)
+            raise
+    return stats
+
+
+def move_tree(src, dst, st, workers, stats, progress, partial_dir, scan):
+    # move() without the removal of src
+    target = dst
+    resume = False
+    if partial_dir is not None:
+        os.makedirs(partial_dir, 0o700, exist_ok=True)
+        target = partial_path(partial_dir, st)
+        resume = op.lexists(target)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if scan is None:
+            scan = scan_tree(src, executor)
+        check_tree(scan, target)
+        try:
+            copy_tree(scan, target, executor, stats, progress, resume)
+        except BaseException:
+            if partial_dir is None and op.lexists(target):
+                remove(target, workers)
+            raise
+    if target != dst:
+        os.rename(target, dst)
@@ -0,0 +1,330 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# A long running process trashing paths on behalf of clients connecting to a
+# Unix domain socket, so that short lived processes don't each pay for the
+# backend import and the trash resolution: the daemon keeps the mount table
+# and trash caches warm and coalesces concurrent requests into batches.
+#
+# Protocol, all integers big endian:
+#   request   u32 count, then count times: u32 length, path bytes (absolute)
+#   response  for each path: u8 status, i32 errno, u32 length, message utf-8,
+#             u32 length, filename bytes
+# A connection can carry any number of requests, one after the other.
+
+import builtins
+import errno
+import os
+import os.path as op
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from send2trash import progress as report
+from send2trash import iter_send2trash as iter_in_process
+from send2trash import send2trash_many as trash_in_process
+from send2trash.exceptions import TrashPermissionError
+from send2trash.util import TrashResult, chunked_paths
+
+SOCKET_ENV = "SEND2TRASH_SOCKET"
+# Batch size cap
+MAX_BATCH = 4096
+# Paths a client sends per request
+CLIENT_CHUNK_SIZE = 1024
+
+OK, OS_ERROR, PERMISSION_ERROR, OTHER_ERROR = range(4)
+U32 = struct.Struct(">I")
+STATUS = struct.Struct(">Bi")
+
+
+def private_dir():
+    # Socket directory without XDG_RUNTIME_DIR, in a directory anyone can write
+    return op.join(tempfile.gettempdir(), "send2trash-%d" % os.getuid())
+
+
+def default_socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and op.isdir(runtime_dir):
+        return op.join(runtime_dir, "send2trash.sock")
+    return op.join(private_dir(), "daemon.sock")
+
+
+def check_private_dir(path):
+    # Anyone able to put a socket in there would get the paths of the clients
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(errno.EACCES, "Socket directory is not private", path)
+
+
+def peer_uid(sock):
+    """Return the uid of the process at the other end of ``sock``, None if unknown."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def read_exact(rfile, size):
+    data = rfile.read(size)
+    if len(data) != size:
+        raise EOFError("Connection closed")
+    return data
+
+
+def read_blob(rfile):
+    return read_exact(rfile, U32.unpack(read_exact(rfile, U32.size))[0])
+
+
+def blob(data):
+    return U32.pack(len(data)) + data
+
+
+def encode_request(paths):
+    return U32.pack(len(paths)) + b"".join(blob(path) for path in paths)
+
+
+def encode_error(error):
+    if error is None:
+        return STATUS.pack(OK, 0) + blob(b"") + blob(b"")
+    if isinstance(error, TrashPermissionError):
+        status = PERMISSION_ERROR
+    elif isinstance(error, OSError):
+        status = OS_ERROR
+    else:
+        status = OTHER_ERROR
+    if isinstance(error, OSError):
+        message = error.strerror or str(error)
+        filename = error.filename
+    else:
+        message = "%s: %s" % (type(error).__name__, error)
+        filename = None
+    filename = b"" if filename is None else os.fsencode(filename)
+    return STATUS.pack(status, getattr(error, "errno", None) or 0) + blob(message.encode("utf-8")) + blob(filename)
+
+
+def read_error(rfile):
+    status, errno_ = STATUS.unpack(read_exact(rfile, STATUS.size))
+    message = read_blob(rfile).decode("utf-8")
+    filename = read_blob(rfile) or None
+    if status == OK:
+        return None
+    if status == PERMISSION_ERROR:
+        return TrashPermissionError(filename)
+    if status == OS_ERROR:
+        return OSError(errno_, message, filename) if errno_ else OSError(message)
+    name, _, message = message.partition(": ")
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        return cls(message)
+    return RuntimeError("%s: %s" % (name, message))
+
+
+class Batcher:
+    """Runs the requests of all the connections as few batches as possible.
+
+    A batch is run as soon as a request arrives, along with the requests
+    already waiting, up to ``max_paths``: requests only pile up into bigger
+    batches while the previous batch runs, a lone request never waits.
+    """
+
+    def __init__(self, jobs=None, max_paths=MAX_BATCH):
+        self.jobs = jobs
+        self.max_paths = max_paths
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="send2trash-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, paths):
+        """Return a Future of the ``(path, error)`` pairs of ``paths``."""
+        future = Future()
+        self.queue.put((paths, future))
+        return future
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        requests = [first]
+        count = len(first[0])
+        while count < self.max_paths:
+            try:
+                request = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop once this batch is done
+                self.queue.put(None)
+                break
+            requests.append(request)
+            count += len(request[0])
+        return requests
+
+    def run(self):
+        while True:
+            requests = self.collect()
+            if requests is None:
+                return
+            paths = [path for request_paths, _ in requests for path in request_paths]
+            try:
+                items = trash_in_process(paths, jobs=self.jobs).items
+            except Exception as error:
+                for _, future in requests:
+                    future.set_exception(error)
+                continue
+            offset = 0
+            for request_paths, future in requests:
+                future.set_result(items[offset : offset + len(request_paths)])
+                offset += len(request_paths)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                count = U32.unpack(read_exact(self.rfile, U32.size))[0]
+                paths = [read_blob(self.rfile) for _ in range(count)]
+            except EOFError:
+                return
+            items = self.server.batcher.submit(paths).result()
+            self.wfile.write(b"".join(encode_error(error) for _, error in items))
+            self.wfile.flush()
+
+
+class TrashServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, jobs=None):
+        self.socket_path = default_socket_path() if socket_path is None else socket_path
+        if op.dirname(self.socket_path) == private_dir():
+            try:
+                os.mkdir(private_dir(), 0o700)
+            except FileExistsError:
+                pass
+            check_private_dir(private_dir())
+        remove_stale_socket(self.socket_path)
+        self.batcher = None
+        # Only the user may connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.ThreadingUnixStreamServer.__init__(self, self.socket_path, RequestHandler)
+        finally:
+            os.umask(umask)
+        self.batcher = Batcher(jobs)
+
+    def verify_request(self, request, client_address):
+        return peer_uid(request) in (None, os.getuid())
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if self.batcher is not None:
+            self.batcher.stop()
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_socket(socket_path):
+    # Left behind by a daemon that didn't exit cleanly, unless one is running
+    if not op.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except ConnectionRefusedError:
+        os.remove(socket_path)
+        return
+    finally:
+        sock.close()
+    raise OSError("A send2trash daemon is already listening on %s" % socket_path)
+
+
+def serve(socket_path=None, jobs=None):
+    """Run a daemon on ``socket_path`` until interrupted."""
+    with TrashServer(socket_path, jobs) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def connect(socket_path=None):
+    """Return a socket connected to the daemon, or None if there is none.
+
+    A daemon run by another user is treated as absent.
+    """
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if op.dirname(socket_path) == private_dir():
+            check_private_dir(private_dir())
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError, PermissionError):
+        sock.close()
+        return None
+    if peer_uid(sock) not in (None, os.getuid()):
+        sock.close()
+        return None
+    return sock
+
+
+def iter_send2trash(paths, socket_path=None, fallback=True, jobs=None, progress=None, stop_on_error=False):
+    """Have the daemon trash ``paths``, yielding a ``(path, error)`` pair per
+    path in input order.
+
+    ``paths`` is sent ``CLIENT_CHUNK_SIZE`` paths at a time, the next chunk
+    once the results of the previous one were consumed. Paths are made
+    absolute here as the daemon runs elsewhere. If no daemon listens on
+    ``socket_path`` the paths are trashed in process, unless ``fallback`` is
+    False, in which case ConnectionRefusedError is raised. ``jobs`` only
+    applies to the in process fallback; through the daemon, ``progress`` only
+    gets the finished events. With ``stop_on_error``, paths are sent one at a
+    time and the iteration ends with the first error.
+    """
+    sock = connect(socket_path)
+    if sock is None:
+        if not fallback:
+            raise ConnectionRefusedError("No send2trash daemon listening")
+        yield from iter_in_process(paths, jobs=jobs, progress=progress, stop_on_error=stop_on_error)
+        return
+    with sock, sock.makefile("rb") as rfile:
+        for chunk in chunked_paths(paths, 1 if stop_on_error else CLIENT_CHUNK_SIZE):
+            sock.sendall(encode_request([op.abspath(os.fsencode(path)) for path in chunk]))
+            for path in chunk:
+                error = read_error(rfile)
+                report.finished(progress, path, error)
+                yield path, error
+                if stop_on_error and error is not None:
+                    return
+
+
+def send2trash_many(paths, socket_path=None, fallback=True, jobs=None, progress=None):
+    """Have the daemon trash ``paths``, return a :class:`~send2trash.util.TrashResult`.
+
+    See :func:`iter_send2trash` for the arguments.
+    """
+    result = TrashResult()
+    for path, error in iter_send2trash(paths, socket_path, fallback, jobs, progress):
+        result.add(path, error)
+    return result
+
+
+def send2trash(paths, socket_path=None, fallback=True):
+    """Like :func:`send2trash.send2trash`, through the daemon when one runs.
+
+    Every path is attempted, then the first error is raised.
+    """
+    send2trash_many(paths, socket_path, fallback).raise_first()
@@ -0,0 +1,138 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# Dry runs of plat_other: where paths would go and what trashing them would
+# cost, without changing anything on disk.
+
+import os
+import os.path as op
+
+from send2trash.plat_other import INFO_DIR, INFO_SUFFIX, PLAN_CHUNK_SIZE, TrashBatch, TrashCache, existing_dev
+from send2trash.util import preprocess_paths, tree_usage
+
+# Rough costs used by DryRun.estimated_seconds, tune them to the storage
+RENAME_SECONDS = 0.0005
+COPY_FILE_SECONDS = 0.002
+COPY_BYTES_PER_SECOND = 100 * 1024 * 1024
+
+
+class DeviceGroup:
+    """Paths of one mount of a device, all going to the same trash directory.
+
+    ``cross_dev`` tells that the trash directory is on another filesystem,
+    so that renames would fail with EXDEV and everything would be copied to
+    the home trash instead (``files`` and ``bytes`` to copy are then counted).
+    """
+
+    __slots__ = ("dev", "dest_trash", "topdir", "paths", "cross_dev", "files", "bytes", "collisions")
+
+    def __init__(self, dev, dest_trash, topdir, cross_dev):
+        self.dev = dev
+        self.dest_trash = dest_trash
+        self.topdir = topdir
+        self.cross_dev = cross_dev
+        self.paths = []
+        self.files = 0
+        self.bytes = 0
+        # Paths whose name is already taken in the trash and will get a suffix
+        self.collisions = []
+
+    def __repr__(self):
+        return "<DeviceGroup %r: %d paths to %r%s>" % (
+            self.dev,
+            len(self.paths),
+            self.dest_trash,
+            " (copied)" if self.cross_dev else "",
+        )
+
+
+class DryRun:
+    """Result of :func:`plan`."""
+
+    def __init__(self):
+        self.groups = {}
+        self.errors = []
+
+    @property
+    def collisions(self):
+        return [path for group in self.groups.values() for path in group.collisions]
+
+    @property
+    def renames(self):
+        return sum(len(group.paths) for group in self.groups.values() if not group.cross_dev)
+
+    @property
+    def copies(self):
+        return sum(len(group.paths) for group in self.groups.values() if group.cross_dev)
+
+    @property
+    def copy_bytes(self):
+        return sum(group.bytes for group in self.groups.values() if group.cross_dev)
+
+    @property
+    def estimated_seconds(self):
+        copy_files = sum(group.files for group in self.groups.values() if group.cross_dev)
+        seconds = self.renames * RENAME_SECONDS + copy_files * COPY_FILE_SECONDS
+        return seconds + self.copy_bytes / float(COPY_BYTES_PER_SECOND)
+
+
+def trash_names(dest_trash):
+    try:
+        entries = os.scandir(op.join(dest_trash, INFO_DIR))
+    except FileNotFoundError:
+        return set()
+    with entries:
+        return {entry.name[: -len(INFO_SUFFIX)] for entry in entries if entry.name.endswith(INFO_SUFFIX)}
+
+
+def plan(paths):
+    """Tell what trashing ``paths`` with plat_other would do, without doing it.
+
+    Paths are checked and their trash resolved the same way as when trashing
+    them, but no trash directory is created. Returns a :class:`DryRun` with a
+    :class:`DeviceGroup` per mount, the paths that would fail with their
+    error, the paths that would collide with existing trash entries (or with
+    each other) and the number of bytes that would need to be copied.
+    """
+    paths = preprocess_paths(paths)
+    batch = TrashBatch(cache=TrashCache(create=False))
+    result = DryRun()
+    names = {}
+    home = None
+    for start in range(0, len(paths), PLAN_CHUNK_SIZE):
+        for item in batch.plan(paths[start : start + PLAN_CHUNK_SIZE]):
+            if item.error is not None:
+                result.errors.append((item.path, item.error))
+                continue
+            # Per mount, not only per device, like the trash locations
+            key = item.location.key
+            group = result.groups.get(key)
+            if group is None:
+                location = item.location
+                try:
+                    cross_dev = existing_dev(location.dest_trash) != item.dev
+                except OSError as error:
+                    result.errors.append((item.path, error))
+                    continue
+                if cross_dev:
+                    if home is None:
+                        home = batch.cache.lookup_home()
+                    location = home
+                group = result.groups[key] = DeviceGroup(item.dev, location.dest_trash, location.topdir, cross_dev)
+            group.paths.append(item.path)
+            taken = names.get(group.dest_trash)
+            if taken is None:
+                taken = names[group.dest_trash] = trash_names(group.dest_trash)
+            name = op.basename(item.path_b)
+            if name in taken:
+                group.collisions.append(item.path)
+            taken.add(name)
+            if group.cross_dev:
+                try:
+                    files, size = tree_usage(item.path_b)
+                except OSError:
+                    continue
+                group.files += files
+                group.bytes += size
+    return result
@@ -18,3 +18,12 @@ class TrashPermissionError(PermissionError):
 
     def __init__(self, filename):
         PermissionError.__init__(self, errno.EACCES, "Permission denied", filename)
+
+
+class SourceRemovalError(OSError):
+    """The source of a move to another device couldn't be fully removed.
+
+    The item was completely copied and is in the trash (``filename2``), but
+    part of it is still at its original location, ``filename`` being what
+    couldn't be removed.
+    """
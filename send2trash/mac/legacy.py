@@ -9,7 +9,8 @@ from __future__ import unicode_literals
 from ctypes import cdll, byref, Structure, c_char, c_char_p
 from ctypes.util import find_library
 
-from send2trash.util import preprocess_paths
+from send2trash import progress as report
+from send2trash.util import iter_paths
 
 Foundation = cdll.LoadLibrary(find_library("Foundation"))
 CoreServices = cdll.LoadLibrary(find_library("CoreServices"))
@@ -39,14 +40,14 @@ def check_op_result(op_result):
         raise OSError(msg)
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    paths = [path.encode("utf-8") if not isinstance(path, bytes) else path for path in paths]
-    for path in paths:
-        fp = FSRef()
-        opts = kFSPathMakeRefDoNotFollowLeafSymlink
-        op_result = FSPathMakeRefWithOptions(path, opts, byref(fp), None)
-        check_op_result(op_result)
-        opts = kFSFileOperationDefaultOptions
-        op_result = FSMoveObjectToTrashSync(byref(fp), None, opts)
-        check_op_result(op_result)
+def send2trash(paths, progress=None):
+    for path in iter_paths(paths):
+        path = path.encode("utf-8") if not isinstance(path, bytes) else path
+        with report.trashing(progress, path):
+            fp = FSRef()
+            opts = kFSPathMakeRefDoNotFollowLeafSymlink
+            op_result = FSPathMakeRefWithOptions(path, opts, byref(fp), None)
+            check_op_result(op_result)
+            opts = kFSFileOperationDefaultOptions
+            op_result = FSMoveObjectToTrashSync(byref(fp), None, opts)
+            check_op_result(op_result)
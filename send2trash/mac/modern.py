@@ -5,7 +5,8 @@
 # http://www.hardcoded.net/licenses/bsd_license
 
 from Foundation import NSFileManager, NSURL
-from send2trash.util import preprocess_paths
+from send2trash import progress as report
+from send2trash.util import iter_paths
 
 
 def check_op_result(op_result):
@@ -15,11 +16,11 @@ def check_op_result(op_result):
         raise OSError(op_result[2].localizedFailureReason())
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    paths = [path.decode("utf-8") if not isinstance(path, str) else path for path in paths]
-    for path in paths:
-        file_url = NSURL.fileURLWithPath_(path)
-        fm = NSFileManager.defaultManager()
-        op_result = fm.trashItemAtURL_resultingItemURL_error_(file_url, None, None)
-        check_op_result(op_result)
+def send2trash(paths, progress=None):
+    for path in iter_paths(paths):
+        path = path.decode("utf-8") if not isinstance(path, str) else path
+        with report.trashing(progress, path):
+            file_url = NSURL.fileURLWithPath_(path)
+            fm = NSFileManager.defaultManager()
+            op_result = fm.trashItemAtURL_resultingItemURL_error_(file_url, None, None)
+            check_op_result(op_result)
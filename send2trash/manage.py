@@ -0,0 +1,406 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# Reading back the freedesktop.org trash directories written by plat_other.
+# See plat_other.py for references to the specification.
+
+import errno
+import os
+import os.path as op
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from urllib.parse import unquote_to_bytes
+
+from send2trash import crossdev, plat_other
+from send2trash.plat_other import FILES_DIR, INFO_DIR, INFO_SUFFIX, TOPDIR_TRASH
+from send2trash.util import TrashResult, remove_trees, rename_noreplace, tree_size
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def parse_trashinfo(data):
+    """Return the raw ``(Path, DeletionDate)`` values of .trashinfo ``data``."""
+    path = date = None
+    in_group = False
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith(b"["):
+            in_group = line == b"[Trash Info]"
+        elif in_group and line.startswith(b"Path="):
+            path = line[5:]
+        elif in_group and line.startswith(b"DeletionDate="):
+            date = line[13:]
+    return path, date
+
+
+class TrashEntry:
+    """An item in a trash directory.
+
+    ``name`` is the name of the item in the ``files`` directory of
+    ``trash_dir``; ``path`` (the absolute original location) and
+    ``deletion_date`` are only read from the .trashinfo file when first
+    accessed. All paths are bytes, use :func:`os.fsdecode` to display them.
+    ``path`` is None when the .trashinfo file can't be read or is invalid,
+    a ``..`` component included, ``deletion_date`` when the date is missing
+    or malformed.
+    """
+
+    __slots__ = ("trash_dir", "topdir", "name", "_path", "_deletion_date")
+
+    def __init__(self, trash_dir, topdir, name):
+        self.trash_dir = trash_dir
+        self.topdir = topdir
+        self.name = name
+        self._path = self._deletion_date = False
+
+    @property
+    def files_path(self):
+        return op.join(self.trash_dir, FILES_DIR, self.name)
+
+    @property
+    def info_path(self):
+        return op.join(self.trash_dir, INFO_DIR, self.name + INFO_SUFFIX)
+
+    def _parse(self):
+        self._path = self._deletion_date = None
+        try:
+            with open(self.info_path, "rb") as f:
+                path, date = parse_trashinfo(f.read())
+        except OSError:
+            return
+        if path:
+            path = unquote_to_bytes(path)
+            # The spec forbids "..", which could point restores anywhere
+            if b".." in path.split(b"/"):
+                return
+            # Relative paths are relative to the topdir of the trash, see info_for()
+            self._path = op.normpath(op.join(self.topdir, path))
+        if date:
+            try:
+                self._deletion_date = datetime.strptime(date.decode("ascii"), DATE_FORMAT)
+            except ValueError:
+                pass
+
+    @property
+    def path(self):
+        if self._path is False:
+            self._parse()
+        return self._path
+
+    @property
+    def deletion_date(self):
+        if self._deletion_date is False:
+            self._parse()
+        return self._deletion_date
+
+    def __repr__(self):
+        return "<TrashEntry %r in %r>" % (self.name, self.trash_dir)
+
+
+def is_global_trash(trash_dir):
+    # Same checks as find_ext_volume_global_trash(), without creating anything
+    try:
+        mode = os.lstat(trash_dir).st_mode
+    except OSError:
+        return False
+    return stat.S_ISDIR(mode) and bool(mode & stat.S_ISVTX)
+
+
+def trash_dirs():
+    """Yield ``(trash_dir, topdir)`` for the home trash and every volume trash."""
+    seen = set()
+    home_trash = plat_other.home_trash()
+    if op.isdir(home_trash):
+        seen.add(home_trash)
+        yield home_trash, plat_other.xdg_data_home()
+    mount_points = plat_other.mount_table.get_mount_points() or ()
+    for mount_point in sorted(mount_points):
+        candidates = []
+        if is_global_trash(op.join(mount_point, TOPDIR_TRASH)):
+            candidates.append(op.join(mount_point, TOPDIR_TRASH, str(os.getuid()).encode("ascii")))
+        candidates.append(op.join(mount_point, plat_other.topdir_fallback()))
+        for trash_dir in candidates:
+            if trash_dir not in seen and op.isdir(trash_dir):
+                seen.add(trash_dir)
+                yield trash_dir, mount_point
+
+
+def default_topdir(trash_dir):
+    parent = op.dirname(op.normpath(trash_dir))
+    # $topdir/.Trash/$uid
+    if op.basename(parent) == TOPDIR_TRASH:
+        return op.dirname(parent)
+    # $XDG_DATA_HOME/Trash and $topdir/.Trash-$uid
+    return parent
+
+
+def trash_locations(trash_dir=None, topdir=None):
+    if trash_dir is None:
+        return trash_dirs()
+    if isinstance(trash_dir, str):
+        trash_dir = os.fsencode(trash_dir)
+    if isinstance(topdir, str):
+        topdir = os.fsencode(topdir)
+    return [(trash_dir, topdir if topdir is not None else default_topdir(trash_dir))]
+
+
+def list_trash(trash_dir=None, topdir=None):
+    """Yield a :class:`TrashEntry` for each item of the trash.
+
+    By default all the trash directories from :func:`trash_dirs` are listed,
+    otherwise only ``trash_dir``, whose relative paths are resolved against
+    ``topdir``. Entries are streamed from ``os.scandir()`` so memory use does
+    not grow with the size of the trash.
+    """
+    for trash_dir, topdir in trash_locations(trash_dir, topdir):
+        try:
+            entries = os.scandir(op.join(trash_dir, INFO_DIR))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.endswith(INFO_SUFFIX):
+                    yield TrashEntry(trash_dir, topdir, entry.name[: -len(INFO_SUFFIX)])
+
+
+def forget_directory_sizes(entries):
+    removed = {}
+    for entry in entries:
+        removed.setdefault(entry.trash_dir, []).append(entry.name)
+    for trash_dir, names in removed.items():
+        try:
+            plat_other.update_directorysizes(trash_dir, removed=names)
+        except OSError:
+            pass
+
+
+def restore_entry(entry, cross_dev=False):
+    # Reverse of trash_move(): the .trashinfo goes last so that a failed move
+    # leaves a valid trash entry behind. Nothing at entry.path is replaced,
+    # even if it was created since it was checked.
+    if cross_dev:
+        # Copied next to entry.path first, so that it can be renamed in place
+        tmp_dir = tempfile.mkdtemp(prefix=b".send2trash-", dir=op.dirname(entry.path))
+        try:
+            tmp_path = op.join(tmp_dir, entry.name)
+            crossdev.copy(entry.files_path, tmp_path)
+            rename_noreplace(tmp_path, entry.path)
+        finally:
+            crossdev.remove(tmp_dir)
+        crossdev.remove(entry.files_path)
+    else:
+        rename_noreplace(entry.files_path, entry.path)
+    os.remove(entry.info_path)
+
+
+def restore(entries):
+    """Move trashed ``entries`` (from :func:`list_trash`) back where they were.
+
+    Returns a :class:`~send2trash.util.TrashResult` with an ``(entry, error)``
+    pair per entry, in input order. An entry whose original path is taken,
+    including by another entry of the same batch, gets a
+    :class:`FileExistsError` and is left in the trash. Missing parent
+    directories are recreated.
+
+    Entries are grouped by destination directory and trash so that each
+    directory is created and each device compared once per group rather than
+    once per entry.
+    """
+    if isinstance(entries, TrashEntry):
+        entries = [entries]
+    entries = list(entries)
+    errors = [None] * len(entries)
+    groups = {}
+    for index, entry in enumerate(entries):
+        if entry.path is None:
+            errors[index] = OSError(errno.EINVAL, "Invalid trash info file", entry.info_path)
+        else:
+            groups.setdefault((op.dirname(entry.path), entry.trash_dir), []).append(index)
+
+    for (parent, trash_dir), indexes in groups.items():
+        try:
+            os.makedirs(parent, exist_ok=True)
+            cross_dev = plat_other.get_dev(parent) != plat_other.get_dev(op.join(trash_dir, FILES_DIR))
+        except OSError as error:
+            for index in indexes:
+                errors[index] = error
+            continue
+        for index in indexes:
+            entry = entries[index]
+            try:
+                restore_entry(entry, cross_dev)
+            except OSError as error:
+                if error.errno == errno.EEXIST:
+                    error = FileExistsError(errno.EEXIST, "Restore destination exists", entry.path)
+                errors[index] = error
+
+    result = TrashResult()
+    for entry, error in zip(entries, errors):
+        result.add(entry, error)
+    forget_directory_sizes(result.succeeded)
+    return result
+
+
+def purge_entries(entries, executor, result):
+    errors = remove_trees([entry.files_path for entry in entries], executor)
+    for entry, error in zip(entries, errors):
+        # The .trashinfo only goes once its files entry is gone, so that an
+        # interrupted purge never leaves an unlisted item in files/
+        if error is None:
+            try:
+                os.remove(entry.info_path)
+            except FileNotFoundError:
+                pass
+            except OSError as info_error:
+                error = info_error
+        result.add(entry, error)
+    forget_directory_sizes([entry for entry, error in result.items[-len(entries) :] if error is None])
+
+
+# Number of entries purged together when streaming through the trash
+PURGE_CHUNK_SIZE = 1024
+
+
+def directory_size(trash_dir, name, cached, updates):
+    # Size of the directory files/<name>, from the directorysizes entries
+    # cached when up to date (matching the mtime of its .trashinfo), walked
+    # otherwise and then added to updates.
+    try:
+        mtime = int(os.stat(op.join(trash_dir, INFO_DIR, name + INFO_SUFFIX)).st_mtime)
+    except FileNotFoundError:
+        mtime = None
+    size, cached_mtime = cached.get(name, (None, None))
+    if size is None or mtime is None or cached_mtime != mtime:
+        size = tree_size(op.join(trash_dir, FILES_DIR, name))
+        if mtime is not None:
+            updates[name] = (size, mtime)
+    return size
+
+
+def select_oversize(expired, remaining, max_bytes):
+    # All of expired plus the oldest of remaining until what's left of
+    # remaining fits in max_bytes. Entries without a date count as oldest.
+    expired = list(expired)
+    names = {(entry.trash_dir, entry.name) for entry in expired}
+    sized = []
+    # (cached, updates) directory sizes per trash directory
+    sizes = {}
+    for entry in remaining:
+        if (entry.trash_dir, entry.name) in names:
+            continue
+        try:
+            st = os.lstat(entry.files_path)
+            if stat.S_ISDIR(st.st_mode):
+                if entry.trash_dir not in sizes:
+                    sizes[entry.trash_dir] = (plat_other.read_directorysizes(entry.trash_dir), {})
+                size = directory_size(entry.trash_dir, entry.name, *sizes[entry.trash_dir])
+            else:
+                size = st.st_size
+        except OSError:
+            size = 0
+        sized.append((entry.deletion_date or datetime.min, size, entry))
+    for trash_dir, (_, updates) in sizes.items():
+        if updates:
+            try:
+                plat_other.update_directorysizes(trash_dir, updates)
+            except OSError:
+                pass
+    sized.sort(key=lambda item: item[0])
+    total = sum(size for _, size, _ in sized)
+    for _, size, entry in sized:
+        if total <= max_bytes:
+            break
+        expired.append(entry)
+        total -= size
+    return expired
+
+
+def purge(older_than=None, max_bytes=None, trash_dir=None, topdir=None, workers=None, now=None):
+    """Permanently delete items from the trash.
+
+    ``older_than`` is a :class:`~datetime.timedelta`: items trashed before
+    ``now - older_than`` are deleted. ``max_bytes`` then deletes the oldest
+    items until at most ``max_bytes`` are left in the trash. With neither, the
+    trash is emptied. ``trash_dir`` and ``topdir`` select the trash as in
+    :func:`list_trash`.
+
+    Deletion runs on a pool of ``workers`` threads. Returns a
+    :class:`~send2trash.util.TrashResult` of ``(entry, error)`` pairs for the
+    items that were selected for deletion.
+    """
+    if older_than is None:
+        entries = [] if max_bytes is not None else list_trash(trash_dir, topdir)
+    else:
+        cutoff = (datetime.now() if now is None else now) - older_than
+        entries = (
+            entry
+            for entry in list_trash(trash_dir, topdir)
+            if entry.deletion_date is not None and entry.deletion_date < cutoff
+        )
+    if max_bytes is not None:
+        entries = select_oversize(entries, list_trash(trash_dir, topdir), max_bytes)
+    entries = iter(entries)
+    result = TrashResult()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(islice(entries, PURGE_CHUNK_SIZE))
+            if not chunk:
+                break
+            purge_entries(chunk, executor, result)
+    return result
+
+
+def trash_size(trash_dir=None, topdir=None):
+    """Return the total size in bytes of the items in the trash.
+
+    Trashed directories are only walked when the directorysizes cache has no
+    up to date entry for them (matching the mtime of their .trashinfo); the
+    cache is then updated with the sizes computed.
+    """
+    total = 0
+    for trash_dir, _ in trash_locations(trash_dir, topdir):
+        try:
+            entries = os.scandir(op.join(trash_dir, FILES_DIR))
+        except FileNotFoundError:
+            continue
+        cached = plat_other.read_directorysizes(trash_dir)
+        seen = set()
+        updates = {}
+        with entries:
+            for entry in entries:
+                name = os.fsencode(entry.name)
+                seen.add(name)
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                        continue
+                    size = directory_size(trash_dir, name, cached, updates)
+                except FileNotFoundError:
+                    # Removed while we were looking
+                    continue
+                total += size
+        stale = [name for name in cached if name not in seen]
+        if updates or stale:
+            try:
+                plat_other.update_directorysizes(trash_dir, updates, stale)
+            except OSError:
+                pass
+    return total
+
+
+def recover(trash_dir=None, topdir=None):
+    """Recover the journals left by dead processes, return a
+    :class:`~send2trash.plat_other.Recovery`.
+
+    Only the journals of ``trash_dir`` are recovered if given, otherwise
+    those of all the trash directories from :func:`trash_dirs`. See
+    :func:`~send2trash.plat_other.recover_journals`.
+    """
+    recovery = plat_other.Recovery()
+    for trash_dir, _ in trash_locations(trash_dir, topdir):
+        recovery.update(plat_other.recover_journals(trash_dir))
+    return recovery
@@ -0,0 +1,113 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# In-memory mount point lookups for plat_other, backed by /proc/self/mountinfo.
+# See proc(5) for the file format and for the poll() notification of changes.
+
+import os
+import os.path as op
+import re
+import threading
+
+try:
+    import select
+
+    POLL_FLAGS = select.POLLPRI | select.POLLERR
+except (ImportError, AttributeError):
+    select = None
+
+MOUNTINFO = b"/proc/self/mountinfo"
+
+# Spaces, tabs, newlines and backslashes are octal escaped in mount points
+ESCAPE_RE = re.compile(rb"\\([0-7]{3})")
+
+
+def unescape(field):
+    return ESCAPE_RE.sub(lambda match: bytes([int(match.group(1), 8)]), field)
+
+
+def parse_mountinfo(data):
+    """Return the set of mount points (as bytes) listed in mountinfo ``data``."""
+    mount_points = set()
+    for line in data.splitlines():
+        fields = line.split(b" ", 5)
+        if len(fields) > 4:
+            mount_points.add(unescape(fields[4]))
+    return mount_points
+
+
+class MountTable:
+    """Mount points of the process, parsed once from ``/proc/self/mountinfo``.
+
+    The kernel flags the open mountinfo file for ``poll()`` whenever the mount
+    table changes, so the table is only parsed again after a mount or unmount.
+    Unlike ``os.path.ismount()``, this also knows about bind mounts.
+
+    Where mountinfo isn't available :meth:`find_mount_point` returns None and
+    callers have to fall back to ``os.path.ismount()``.
+    """
+
+    def __init__(self, path=MOUNTINFO):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+        self.poller = None
+        self.mount_points = None
+        self.unavailable = False
+
+    def _read(self):
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.mount_points = parse_mountinfo(b"".join(chunks))
+
+    def _open(self):
+        try:
+            self.fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        except OSError:
+            self.unavailable = True
+            return
+        if select is not None and hasattr(select, "poll"):
+            self.poller = select.poll()
+            self.poller.register(self.fd, POLL_FLAGS)
+
+    def get_mount_points(self):
+        """Return the current set of mount points, or None if unknown."""
+        if self.unavailable:
+            return None
+        with self.lock:
+            if self.fd is None:
+                self._open()
+                if self.unavailable:
+                    return None
+                self._read()
+            elif self.poller is None or self.poller.poll(0):
+                self._read()
+            return self.mount_points
+
+    def find_mount_point(self, path):
+        """Return the mount point containing ``path``, which must be a realpath."""
+        mount_points = self.get_mount_points()
+        if mount_points is None:
+            return None
+        is_str = isinstance(path, str)
+        if is_str:
+            path = os.fsencode(path)
+        while path not in mount_points:
+            parent = op.dirname(path)
+            if parent == path:
+                # Not even / is listed (e.g. in a chroot), let the caller decide
+                return None
+            path = parent
+        return os.fsdecode(path) if is_str else path
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+            self.fd = self.poller = self.mount_points = None
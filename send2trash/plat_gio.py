@@ -4,20 +4,119 @@
 # which should be included with this package. The terms are also available at
 # http://www.hardcoded.net/licenses/bsd_license
 
-from gi.repository import GObject, Gio
+import errno
+import time
+
+from gi.repository import GLib, GObject, Gio
+from send2trash import progress as report
 from send2trash.exceptions import TrashPermissionError
-from send2trash.util import preprocess_paths
+from send2trash.util import TrashResult, chunked_paths, iter_paths
+
+# Trash requests handed to GIO's worker threads at once by send2trash_many()
+MAX_IN_FLIGHT = 16
+# Paths read from the input at a time
+CHUNK_SIZE = 1024
+
+
+def convert_error(e, path):
+    if e.code == Gio.IOErrorEnum.NOT_SUPPORTED:
+        # We get here if we can't create a trash directory on the same
+        # device. I don't know if other errors can result in NOT_SUPPORTED.
+        return TrashPermissionError("")
+    if e.code == Gio.IOErrorEnum.CANCELLED:
+        return OSError(errno.ECANCELED, e.message, path)
+    return OSError(e.message)
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    for path in paths:
+def trash_chunk(paths, max_in_flight, cancellable, progress, stop_on_error):
+    # Return the error of each path of the paths list, None if it was trashed
+    errors = [None] * len(paths)
+    state = {"next": 0, "in_flight": 0}
+    context = GLib.MainContext()
+
+    def done(f, async_result, data):
+        index, start = data
+        path = paths[index]
         try:
-            f = Gio.File.new_for_path(path)
-            f.trash(cancellable=None)
+            f.trash_finish(async_result)
         except GObject.GError as e:
-            if e.code == Gio.IOErrorEnum.NOT_SUPPORTED:
-                # We get here if we can't create a trash directory on the same
-                # device. I don't know if other errors can result in NOT_SUPPORTED.
-                raise TrashPermissionError("")
-            raise OSError(e.message)
+            errors[index] = convert_error(e, path)
+            if stop_on_error:
+                cancellable.cancel()
+        state["in_flight"] -= 1
+        if progress is not None:
+            progress(report.ProgressEvent(report.PHASE, path, phase=report.TRASH, seconds=time.monotonic() - start))
+            report.finished(progress, path, errors[index])
+
+    def submit():
+        while state["in_flight"] < max_in_flight and state["next"] < len(paths):
+            index = state["next"]
+            state["next"] += 1
+            if cancellable.is_cancelled():
+                errors[index] = OSError(errno.ECANCELED, "Operation was cancelled", paths[index])
+                continue
+            report.started(progress, paths[index])
+            state["in_flight"] += 1
+            f = Gio.File.new_for_path(paths[index])
+            f.trash_async(GLib.PRIORITY_DEFAULT, cancellable, done, (index, time.monotonic()))
+
+    context.push_thread_default()
+    try:
+        submit()
+        while state["in_flight"]:
+            context.iteration(True)
+            submit()
+    finally:
+        context.pop_thread_default()
+    return errors
+
+
+def iter_send2trash(paths, max_in_flight=MAX_IN_FLIGHT, cancellable=None, progress=None, stop_on_error=False):
+    """Trash ``paths`` with ``Gio.File.trash_async``, yielding a
+    ``(path, error)`` pair per path in input order.
+
+    At most ``max_in_flight`` requests run at once on GIO's worker threads;
+    their completions are dispatched on a private main context iterated by
+    this function. ``paths`` can be any iterable, read ``CHUNK_SIZE`` paths
+    at a time once the results of the previous chunk were consumed.
+    Cancelling ``cancellable`` (a ``Gio.Cancellable``) cancels the requests
+    in flight and fails the paths not submitted yet with ECANCELED, as does
+    the first error with ``stop_on_error`` (the iteration then ends with the
+    chunk of that error).
+    """
+    if cancellable is None:
+        cancellable = Gio.Cancellable()
+    for chunk in chunked_paths(paths, CHUNK_SIZE):
+        errors = trash_chunk(chunk, max_in_flight, cancellable, progress, stop_on_error)
+        yield from zip(chunk, errors)
+        if stop_on_error and cancellable.is_cancelled():
+            return
+
+
+def send2trash_many(paths, max_in_flight=MAX_IN_FLIGHT, cancellable=None, progress=None):
+    """Trash ``paths`` with ``Gio.File.trash_async``, return a
+    :class:`~send2trash.util.TrashResult` once every request completed.
+
+    See :func:`iter_send2trash` for the arguments.
+    """
+    result = TrashResult()
+    for path, error in iter_send2trash(paths, max_in_flight, cancellable, progress):
+        result.add(path, error)
+    return result
+
+
+def send2trash(paths, progress=None):
+    if not hasattr(Gio.File, "trash_async"):
+        # GIO older than 2.38
+        for path in iter_paths(paths):
+            with report.trashing(progress, path):
+                try:
+                    f = Gio.File.new_for_path(path)
+                    f.trash(cancellable=None)
+                except GObject.GError as e:
+                    raise convert_error(e, path)
+        return
+    # One path at a time: nothing after the first error is trashed
+    for _, error in iter_send2trash(paths, max_in_flight=1, progress=progress, stop_on_error=True):
+        if error is not None:
+            raise error
@@ -19,19 +19,32 @@ from __future__ import unicode_literals
 import errno
 import sys
 import os
-import shutil
+import re
 import os.path as op
 from datetime import datetime
 import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    from urllib.parse import quote
+    from urllib.parse import quote, unquote_to_bytes
 except ImportError:
     # Python 2
-    from urllib import quote
+    from urllib import quote, unquote as unquote_to_bytes
 
-from send2trash.util import preprocess_paths
-from send2trash.exceptions import TrashPermissionError
+from send2trash import crossdev
+from send2trash import progress as report
+from send2trash import tracing
+from send2trash.mounts import MountTable
+from send2trash.util import chunked_paths, sync_filesystem, TrashResult
+from send2trash.exceptions import SourceRemovalError, TrashPermissionError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 try:
     fsencode = os.fsencode  # Python 3
@@ -50,15 +63,43 @@ except AttributeError:
 FILES_DIR = b"files"
 INFO_DIR = b"info"
 INFO_SUFFIX = b".trashinfo"
+DIRECTORYSIZES = b"directorysizes"
 
-# Default of ~/.local/share [3]
-XDG_DATA_HOME = op.expanduser(os.environb.get(b"XDG_DATA_HOME", b"~/.local/share"))
-HOMETRASH_B = op.join(XDG_DATA_HOME, b"Trash")
-HOMETRASH = fsdecode(HOMETRASH_B)
-
-uid = os.getuid()
 TOPDIR_TRASH = b".Trash"
-TOPDIR_FALLBACK = b".Trash-" + str(uid).encode("ascii")
+# Directory of a trash holding the trees being copied from another device
+PARTIAL_DIR = b"partial"
+# Directory of a trash holding the write-ahead journals, see Journal
+JOURNAL_DIR = b"journal"
+
+
+# The values depending on the environment are read when needed rather than at
+# import. They are still available as the XDG_DATA_HOME, HOMETRASH_B,
+# HOMETRASH, uid and TOPDIR_FALLBACK attributes of the module, see __getattr__.
+def xdg_data_home():
+    # Default of ~/.local/share [3]
+    return op.expanduser(os.environb.get(b"XDG_DATA_HOME", b"~/.local/share"))
+
+
+def home_trash():
+    return op.join(xdg_data_home(), b"Trash")
+
+
+def topdir_fallback():
+    return b".Trash-" + str(os.getuid()).encode("ascii")
+
+
+def __getattr__(name):
+    if name == "XDG_DATA_HOME":
+        return xdg_data_home()
+    if name == "HOMETRASH_B":
+        return home_trash()
+    if name == "HOMETRASH":
+        return fsdecode(home_trash())
+    if name == "uid":
+        return os.getuid()
+    if name == "TOPDIR_FALLBACK":
+        return topdir_fallback()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def is_parent(parent, path):
@@ -82,7 +123,20 @@ def info_for(src, topdir):
         src = op.abspath(src)
     else:
         src = op.relpath(src, topdir)
+    return format_info(src)
+
 
+def info_path(real_path, real_topdir):
+    # info_for() for paths already resolved with realpath()
+    if real_topdir is not None:
+        if real_topdir == b"/":
+            return real_path[1:]
+        if real_path.startswith(real_topdir + b"/"):
+            return real_path[len(real_topdir) + 1 :]
+    return real_path
+
+
+def format_info(src):
     info = "[Trash Info]\n"
     info += "Path=" + quote(src) + "\n"
     info += "DeletionDate=" + format_date(datetime.now()) + "\n"
@@ -90,45 +144,483 @@ def info_for(src, topdir):
 
 
 def check_create(dir):
-    # use 0700 for paths [3]
-    if not op.exists(dir):
-        os.makedirs(dir, 0o700)
+    with tracing.span("check_create"):
+        tracing.syscall("stat")
+        # use 0700 for paths [3]
+        if not op.exists(dir):
+            tracing.syscall("mkdir")
+            # exist_ok as another thread may be creating the same trash
+            os.makedirs(dir, 0o700, exist_ok=True)
+
+
+def prepare_trash(dst):
+    check_create(op.join(dst, FILES_DIR))
+    check_create(op.join(dst, INFO_DIR))
+
+
+# Whether operations can be done relative to open directories (the *at()
+# system calls) so that the kernel doesn't resolve full paths every time.
+USE_DIR_FD = {os.open, os.rename, os.stat, os.access} <= os.supports_dir_fd
+# O_PATH is enough for *at() calls and doesn't need read permission
+DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_PATH", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+class DirFd:
+    """A file descriptor on a directory, closed when garbage collected.
+
+    Being closed only once unreferenced, it can be shared between threads and
+    cached without ever being used after close.
+    """
+
+    __slots__ = ("fd",)
+
+    def __init__(self, path):
+        self.fd = os.open(path, DIR_FLAGS)
+
+    def __del__(self):
+        fd = getattr(self, "fd", None)
+        if fd is not None:
+            os.close(fd)
 
 
-def trash_move(src, dst, topdir=None, cross_dev=False):
+class TrashDirFds:
+    """Open ``files`` and ``info`` directories of a trash."""
+
+    __slots__ = ("files", "info")
+
+    def __init__(self, dst):
+        self.files = DirFd(op.join(dst, FILES_DIR))
+        self.info = DirFd(op.join(dst, INFO_DIR))
+
+
+# "name 3.ext" as produced by NameAllocator for the third collision of "name.ext"
+SUFFIX_RE = re.compile(rb"^(.*) ([0-9]+)$")
+
+
+class NameAllocator:
+    """Hands out collision free entry names for trash directories.
+
+    The highest numeric suffix used for every base name is indexed with a
+    single scan of ``info/`` the first time a trash directory is seen, so
+    picking a name does not probe ``name 1``, ``name 2``, ... one by one.
+    A name is only handed out once its ``.trashinfo`` file was created with
+    ``O_EXCL``, which keeps concurrent trashers (threads or other processes)
+    from ever sharing a name even if the index is stale.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+    def _scan(self, infopath):
+        tracing.syscall("scandir")
+        index = {}
+        try:
+            entries = os.scandir(infopath)
+        except FileNotFoundError:
+            return index
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith(INFO_SUFFIX):
+                    continue
+                base_name, ext = op.splitext(entry.name[: -len(INFO_SUFFIX)])
+                counter = 0
+                match = SUFFIX_RE.match(base_name)
+                if match is not None:
+                    base_name, counter = match.group(1), int(match.group(2))
+                key = (base_name, ext)
+                if index.get(key, -1) < counter:
+                    index[key] = counter
+        return index
+
+    def _claim(self, infopath, key):
+        with self.lock:
+            index = self.indexes.get(infopath)
+            if index is None:
+                index = self.indexes[infopath] = self._scan(infopath)
+            counter = index[key] = index.get(key, -1) + 1
+            return counter
+
+    def reserve(self, filespath, infopath, filename, dir_fds=None):
+        """Reserve a name for ``filename``, return ``(destname, info_fd)``.
+
+        ``info_fd`` is a file descriptor open for writing on the freshly
+        created (empty) ``.trashinfo`` file of the reserved name. With
+        ``dir_fds`` (:class:`TrashDirFds`) names are looked up relative to
+        the open directories instead of the paths.
+        """
+        with tracing.span("reserve_name"):
+            return self._reserve(filespath, infopath, filename, dir_fds)
+
+    def _reserve(self, filespath, infopath, filename, dir_fds):
+        base_name, ext = op.splitext(filename)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+        while True:
+            counter = self._claim(infopath, (base_name, ext))
+            if counter:
+                destname = base_name + b" " + str(counter).encode("ascii") + ext
+            else:
+                destname = filename
+            tracing.syscall("lstat")
+            try:
+                if dir_fds is None:
+                    if op.lexists(op.join(filespath, destname)):
+                        continue
+                    tracing.syscall("open")
+                    fd = os.open(op.join(infopath, destname + INFO_SUFFIX), flags, 0o600)
+                else:
+                    try:
+                        os.stat(destname, dir_fd=dir_fds.files.fd, follow_symlinks=False)
+                        continue
+                    except FileNotFoundError:
+                        pass
+                    tracing.syscall("open")
+                    fd = os.open(destname + INFO_SUFFIX, flags, 0o600, dir_fd=dir_fds.info.fd)
+            except FileExistsError:
+                continue
+            return destname, fd
+
+
+name_allocator = NameAllocator()
+
+
+def trash_move(
+    src,
+    dst,
+    topdir=None,
+    cross_dev=False,
+    prepared=False,
+    copy_stats=None,
+    dir_fds=None,
+    src_dir_fd=None,
+    info=None,
+    progress=None,
+    resume=False,
+    journal=None,
+    scan=None,
+    sync=False,
+):
+    # dir_fds (TrashDirFds of dst) and src_dir_fd (DirFd of the parent of src)
+    # let batches skip resolving the full paths over and over, info is the
+    # .trashinfo content when already known. progress gets the phase timings
+    # and copied bytes of src. With resume, a tree copied from another device
+    # goes through PARTIAL_DIR, where an interrupted copy is picked up again.
+    # journal is the Journal of dst recording the move, scan the
+    # crossdev.TreeScan of a tree src when it was already scanned. With sync,
+    # a copy from another device is on disk before src is removed.
     filename = op.basename(src)
     filespath = op.join(dst, FILES_DIR)
     infopath = op.join(dst, INFO_DIR)
-    base_name, ext = op.splitext(filename)
 
-    counter = 0
-    destname = filename
-    while op.exists(op.join(filespath, destname)) or op.exists(op.join(infopath, destname + INFO_SUFFIX)):
-        counter += 1
-        destname = base_name + b" " + str(counter).encode("ascii") + ext
+    # Batch callers create files/ and info/ once per trash directory up front
+    if not prepared:
+        prepare_trash(dst)
 
-    check_create(filespath)
-    check_create(infopath)
+    with report.phase(progress, src, report.INFO):
+        destname, fd = name_allocator.reserve(filespath, infopath, filename, dir_fds)
+        f = os.fdopen(fd, "w")
+        if journal is not None:
+            try:
+                journal.begin(destname, op.abspath(src))
+            except BaseException:
+                f.close()
+                abort_entry(dst, destname, None)
+                raise
+        try:
+            with tracing.span("write_info"), f:
+                tracing.syscall("write")
+                tracing.syscall("close")
+                f.write(info_for(src, topdir) if info is None else info)
+        except BaseException:
+            abort_entry(dst, destname, journal)
+            raise
+    try:
+        move_entry(src, dst, destname, cross_dev, copy_stats, dir_fds, src_dir_fd, progress, resume, scan, sync)
+    except SourceRemovalError:
+        # Copied in full: the entry stays in the trash, .trashinfo included
+        if journal is not None:
+            journal.commit(destname)
+        raise
+    except BaseException:
+        abort_entry(dst, destname, journal)
+        raise
+    if journal is not None:
+        journal.commit(destname)
+    return destname
 
-    with open(op.join(infopath, destname + INFO_SUFFIX), "w") as f:
-        f.write(info_for(src, topdir))
-    destpath = op.join(filespath, destname)
+
+def move_entry(src, dst, destname, cross_dev, copy_stats, dir_fds, src_dir_fd, progress, resume, scan, sync):
+    # The files/ part of trash_move()
+    destpath = op.join(dst, FILES_DIR, destname)
     if cross_dev:
-        shutil.move(fsdecode(src), fsdecode(destpath))
-    else:
-        os.rename(src, destpath)
+        with report.phase(progress, src, report.COPY), tracing.span("crossdev_move"):
+            partial_dir = op.join(dst, PARTIAL_DIR) if resume else None
+            crossdev.move(
+                src,
+                destpath,
+                stats=copy_stats,
+                progress=report.copied(progress, src),
+                partial_dir=partial_dir,
+                scan=scan,
+                sync=sync,
+            )
+        return
+    with report.phase(progress, src, report.RENAME), tracing.span("rename"):
+        tracing.syscall("rename")
+        if dir_fds is not None:
+            if src_dir_fd is not None:
+                os.rename(op.basename(src), destname, src_dir_fd=src_dir_fd.fd, dst_dir_fd=dir_fds.files.fd)
+            else:
+                os.rename(src, destname, dst_dir_fd=dir_fds.files.fd)
+        else:
+            os.rename(src, destpath)
+
+
+def abort_entry(dst, destname, journal):
+    # Don't leave a .trashinfo behind for an entry that couldn't be moved
+    try:
+        os.remove(op.join(dst, INFO_DIR, destname + INFO_SUFFIX))
+    except OSError:
+        pass
+    if journal is not None:
+        journal.abort(destname)
+
+
+def quote_record(path):
+    return quote(path, safe="/").encode("ascii")
+
+
+class Journal:
+    """Write-ahead journal of the entries a process adds to a trash directory.
+
+    A ``B`` record is appended once the name of an entry is reserved, before
+    its .trashinfo is written, then a ``C`` record once its ``files/`` entry
+    is in place or an ``A`` record once the attempt was undone. Each journal
+    is a file of the ``journal`` directory of the trash, locked by its process
+    for as long as it is open: :func:`recover_journals` only replays the
+    journals it can lock, those left by processes that died. A journal is
+    removed when closed with no entry left in progress.
+    """
+
+    def __init__(self, trash_dir):
+        journal_dir = op.join(trash_dir, JOURNAL_DIR)
+        check_create(journal_dir)
+        while True:
+            fd, tmp_path = tempfile.mkstemp(prefix=b".", dir=journal_dir)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            path = op.join(journal_dir, op.basename(tmp_path)[1:])
+            try:
+                # Under its final name only once locked
+                os.rename(tmp_path, path)
+            except FileNotFoundError:
+                # Removed by a recovery before it was locked
+                os.close(fd)
+                continue
+            break
+        self.path = path
+        self.fd = fd
+        self.lock = threading.Lock()
+        self.in_progress = 0
+
+    def write(self, record, change):
+        with self.lock:
+            tracing.syscall("write")
+            os.write(self.fd, record)
+            self.in_progress += change
+
+    def begin(self, destname, src):
+        self.write(b"B " + quote_record(destname) + b" " + quote_record(src) + b"\n", 1)
+
+    def commit(self, destname):
+        self.write(b"C " + quote_record(destname) + b"\n", -1)
+
+    def abort(self, destname):
+        self.write(b"A " + quote_record(destname) + b"\n", -1)
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        with self.lock:
+            if not self.in_progress:
+                os.remove(self.path)
+            os.close(self.fd)
+
+
+class Recovery:
+    """What :func:`recover_journals` found.
+
+    ``trashed`` has the source paths of the entries that made it to the
+    trash, ``rolled_forward`` those of them completed by the recovery, and
+    ``rolled_back`` the source paths of the entries undone.
+    """
+
+    def __init__(self):
+        self.trashed = []
+        self.rolled_forward = []
+        self.rolled_back = []
+
+    def update(self, other):
+        self.trashed += other.trashed
+        self.rolled_forward += other.rolled_forward
+        self.rolled_back += other.rolled_back
+
+
+def replay_journal(trash_dir, data, recovery):
+    in_progress = {}
+    for line in data.splitlines():
+        fields = line.split(b" ")
+        # A truncated last record has a missing field or no newline
+        if fields[0] == b"B" and len(fields) == 3:
+            in_progress[unquote_to_bytes(fields[1])] = unquote_to_bytes(fields[2])
+        elif fields[0] in (b"C", b"A") and len(fields) == 2:
+            src = in_progress.pop(unquote_to_bytes(fields[1]), None)
+            if src is not None and fields[0] == b"C":
+                recovery.trashed.append(src)
+    for destname, src in in_progress.items():
+        info = op.join(trash_dir, INFO_DIR, destname + INFO_SUFFIX)
+        if op.lexists(op.join(trash_dir, FILES_DIR, destname)):
+            # Moved, the .trashinfo may not have been written yet, or even
+            # be gone if it wasn't synced
+            try:
+                size = os.path.getsize(info)
+            except FileNotFoundError:
+                size = 0
+            if size == 0:
+                with open(info, "w") as f:
+                    f.write(format_info(src))
+            recovery.trashed.append(src)
+            recovery.rolled_forward.append(src)
+        else:
+            try:
+                os.remove(info)
+            except FileNotFoundError:
+                pass
+            recovery.rolled_back.append(src)
+
+
+def recover_journals(trash_dir):
+    """Replay the journals of ``trash_dir`` left by processes that died.
+
+    Entries whose ``files/`` part was moved are rolled forward, writing their
+    .trashinfo if it is empty or missing, the others are rolled back by removing their
+    .trashinfo. Trees copied from another device stay in the ``partial``
+    directory to be resumed. Returns a :class:`Recovery`.
+    """
+    recovery = Recovery()
+    journal_dir = op.join(trash_dir, JOURNAL_DIR)
+    try:
+        names = os.listdir(journal_dir)
+    except FileNotFoundError:
+        return recovery
+    for name in names:
+        path = op.join(journal_dir, name)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Its process is still running
+                continue
+            if os.fstat(fd).st_nlink == 0:
+                # Replayed by another recovery while we waited
+                continue
+            with open(fd, "rb", closefd=False) as f:
+                replay_journal(trash_dir, f.read(), recovery)
+            os.remove(path)
+        finally:
+            os.close(fd)
+    return recovery
+
+
+# The directorysizes cache [1] has a "size mtime name" line per directory of
+# files/, mtime being the one of the directory's .trashinfo, so that the size
+# of the trash can be computed without walking trashed directories.
+directorysizes_lock = threading.Lock()
+
+
+def read_directorysizes(trash_dir):
+    """Return ``{name: (size, mtime)}`` from the directorysizes cache."""
+    sizes = {}
+    try:
+        with open(op.join(trash_dir, DIRECTORYSIZES), "rb") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 3:
+                    continue
+                try:
+                    sizes[unquote_to_bytes(fields[2])] = (int(fields[0]), int(fields[1]))
+                except ValueError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return sizes
+
+
+def update_directorysizes(trash_dir, updates=None, removed=()):
+    """Add ``updates`` to the directorysizes cache and drop the ``removed`` names.
+
+    The cache is rewritten to a temporary file which then atomically replaces
+    the previous one.
+    """
+    updates = updates or {}
+    with directorysizes_lock:
+        sizes = read_directorysizes(trash_dir)
+        removed = [name for name in removed if name in sizes and name not in updates]
+        if not updates and not removed:
+            return
+        for name in removed:
+            del sizes[name]
+        sizes.update(updates)
+        fd, tmp_path = tempfile.mkstemp(prefix=DIRECTORYSIZES + b".", dir=trash_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                for name, (size, mtime) in sizes.items():
+                    f.write("%d %d %s\n" % (size, mtime, quote(name)))
+            os.replace(tmp_path, op.join(trash_dir, DIRECTORYSIZES))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def directory_size_entry(trash_dir, destname, size):
+    """Return the ``(size, mtime)`` directorysizes value of a trashed directory."""
+    mtime = os.stat(op.join(trash_dir, INFO_DIR, destname + INFO_SUFFIX)).st_mtime
+    return size, int(mtime)
+
+
+mount_table = MountTable()
 
 
 def find_mount_point(path):
-    # Even if something's wrong, "/" is a mount point, so the loop will exit.
-    # Use realpath in case it's a symlink
-    path = op.realpath(path)  # Required to avoid infinite loop
-    while not op.ismount(path):  # Note ismount() does not always detect mounts
-        path = op.split(path)[0]
-    return path
+    with tracing.span("find_mount_point"):
+        tracing.syscall("realpath")
+        # Use realpath in case it's a symlink
+        path = op.realpath(path)  # Required to avoid infinite loop
+        mount_point = mount_table.find_mount_point(path)
+        if mount_point is not None:
+            return mount_point
+        # No mount table, walk up the path instead.
+        # Even if something's wrong, "/" is a mount point, so the loop will exit.
+        while not op.ismount(path):  # Note ismount() does not always detect mounts
+            tracing.syscall("lstat", 2)
+            path = op.split(path)[0]
+        return path
+
+
+def can_create(dir):
+    # What check_create() would do, without creating anything
+    return op.exists(dir) or os.access(op.dirname(dir), os.W_OK)
 
 
-def find_ext_volume_global_trash(volume_root):
+def find_ext_volume_global_trash(volume_root, create=True):
     # from [2] Trash directories (1) check for a .Trash dir with the right
     # permissions set.
     trash_dir = op.join(volume_root, TOPDIR_TRASH)
@@ -141,7 +633,9 @@ def find_ext_volume_global_trash(volume_root):
     if not op.isdir(trash_dir) or op.islink(trash_dir) or not (mode & stat.S_ISVTX):
         return None
 
-    trash_dir = op.join(trash_dir, str(uid).encode("ascii"))
+    trash_dir = op.join(trash_dir, str(os.getuid()).encode("ascii"))
+    if not create:
+        return trash_dir if can_create(trash_dir) else None
     try:
         check_create(trash_dir)
     except OSError:
@@ -149,9 +643,13 @@ def find_ext_volume_global_trash(volume_root):
     return trash_dir
 
 
-def find_ext_volume_fallback_trash(volume_root):
+def find_ext_volume_fallback_trash(volume_root, create=True):
     # from [2] Trash directories (1) create a .Trash-$uid dir.
-    trash_dir = op.join(volume_root, TOPDIR_FALLBACK)
+    trash_dir = op.join(volume_root, topdir_fallback())
+    if not create:
+        if not can_create(trash_dir):
+            raise TrashPermissionError(trash_dir)
+        return trash_dir
     # Try to make the directory, if we lack permission, raise TrashPermissionError
     try:
         check_create(trash_dir)
@@ -162,10 +660,12 @@ def find_ext_volume_fallback_trash(volume_root):
     return trash_dir
 
 
-def find_ext_volume_trash(volume_root):
-    trash_dir = find_ext_volume_global_trash(volume_root)
+def find_ext_volume_trash(volume_root, create=True):
+    # With create False, nothing is created and the directory returned may
+    # not exist yet.
+    trash_dir = find_ext_volume_global_trash(volume_root, create)
     if trash_dir is None:
-        trash_dir = find_ext_volume_fallback_trash(volume_root)
+        trash_dir = find_ext_volume_fallback_trash(volume_root, create)
     return trash_dir
 
 
@@ -174,44 +674,644 @@ def get_dev(path):
     return os.lstat(path).st_dev
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    for path in paths:
+def existing_dev(path):
+    # Device of path or, as the trash may not exist yet, of its closest parent
+    while True:
+        try:
+            return get_dev(path)
+        except FileNotFoundError:
+            parent = op.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+# Same as get_dev(), for a path that was already lstat()ed
+def stat_dev(path, st):
+    return st.st_dev
+
+
+def find_trash(path, path_dev, home_dev, create=True):
+    """Return ``(dest_trash, topdir)`` for ``path`` living on device ``path_dev``.
+
+    Unless ``create``, volume trash directories are not created (so may not
+    exist yet).
+    """
+    # if the file to be trashed is on the same device as HOMETRASH we
+    # want to move it there.
+    if path_dev == home_dev:
+        return home_trash(), xdg_data_home()
+    with tracing.span("find_trash"):
+        topdir = find_mount_point(path)
+        tracing.syscall("lstat")
+        if get_dev(topdir) != path_dev:
+            raise OSError("Couldn't find mount point for %s" % fsdecode(path))
+        return find_ext_volume_trash(topdir, create), topdir
+
+
+# Seconds a cached trash location is trusted before its checks are redone
+TRASH_CACHE_TTL = 60.0
+
+
+class TrashLocation:
+    __slots__ = ("dest_trash", "topdir", "checked", "key", "prepared", "dir_fds", "_real_topdir", "_dev")
+
+    def __init__(self, dest_trash, topdir, checked, key=None):
+        self.dest_trash = dest_trash
+        self.topdir = topdir
+        self.checked = checked
+        # Key of the location in the TrashCache
+        self.key = key
+        # Whether files/ and info/ are known to exist
+        self.prepared = False
+        # TrashDirFds, once prepared
+        self.dir_fds = None
+        self._real_topdir = None
+        self._dev = None
+
+    @property
+    def real_topdir(self):
+        if self._real_topdir is None and self.topdir is not None:
+            self._real_topdir = op.realpath(self.topdir)
+        return self._real_topdir
+
+    @property
+    def dev(self):
+        # Device of the trash, paths of other devices are copied to the home trash
+        if self._dev is None:
+            self._dev = existing_dev(self.dest_trash)
+        return self._dev
+
+    def prepare(self):
+        prepare_trash(self.dest_trash)
+        if USE_DIR_FD:
+            self.dir_fds = TrashDirFds(self.dest_trash)
+        self.prepared = True
+
+
+class TrashCache:
+    """Process wide cache of the trash directory to use for each mount.
+
+    Maps ``st_dev`` and mount point to the topdir and trash directory resolved
+    for them, so that long running processes don't redo the mount point and
+    ``.Trash`` checks for every file. Entries are trusted for ``ttl`` seconds
+    and all of them are dropped when the mount table changes. Callers
+    :meth:`invalidate` an entry when an operation using it fails, so that the
+    sticky bit and symlink status of ``.Trash`` are checked again. The mount
+    point, looked up in the in-memory mount table, tells apart the mounts of a
+    filesystem mounted more than once, between which renames fail with EXDEV.
+    """
+
+    def __init__(self, ttl=None, create=True):
+        self.ttl = TRASH_CACHE_TTL if ttl is None else ttl
+        # Whether volume trash directories are created while resolving them
+        self.create = create
+        self.lock = threading.Lock()
+        self.home_dev = None
+        self.home_checked = None
+        self.entries = {}
+        self.mount_points = None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.home_dev = self.home_checked = None
+
+    def _get_home_dev(self, now):
+        if self.home_dev is None or now - self.home_checked >= self.ttl:
+            # If XDG_DATA_HOME or HOMETRASH do not yet exist we need to stat the
+            # home directory, and these paths will be created further on if needed.
+            self.home_dev = get_dev(op.expanduser(b"~"))
+            self.home_checked = now
+        return self.home_dev
+
+    def _lookup(self, key, resolve):
+        now = time.monotonic()
+        with self.lock:
+            mount_points = mount_table.get_mount_points()
+            if mount_points is not self.mount_points:
+                # Something was (un)mounted, devices may now map to other places
+                self.entries.clear()
+                self.mount_points = mount_points
+            location = self.entries.get(key)
+            if location is None or now - location.checked >= self.ttl:
+                dest_trash, topdir = resolve(self._get_home_dev(now))
+                location = self.entries[key] = TrashLocation(dest_trash, topdir, now, key)
+            return location
+
+    def lookup(self, path, path_dev):
+        """Return the :class:`TrashLocation` for ``path``, a realpath, living on ``path_dev``."""
+        key = (path_dev, mount_table.find_mount_point(path))
+        return self._lookup(key, lambda home_dev: find_trash(path, path_dev, home_dev, self.create))
+
+    def lookup_home(self):
+        """Return the :class:`TrashLocation` of the home trash."""
+        with self.lock:
+            home_dev = self._get_home_dev(time.monotonic())
+        return self._lookup((home_dev, None), lambda home_dev: (home_trash(), xdg_data_home()))
+
+    def invalidate(self, location):
+        """Forget ``location``, return whether it was cached."""
+        with self.lock:
+            if location.key is None or self.entries.get(location.key) is not location:
+                return False
+            del self.entries[location.key]
+            return True
+
+
+trash_cache = TrashCache()
+
+
+def clear_cache():
+    """Forget all the cached trash directories and entry name indexes."""
+    trash_cache.clear()
+    name_allocator.clear()
+
+
+# Number of trashed items after which a durable batch syncs
+DURABLE_SYNC_EVERY = 1000
+
+
+class DurabilityStats:
+    """What a durable :class:`TrashBatch` did to get its items on disk."""
+
+    def __init__(self):
+        # Items written to disk, sync points reached and fsync/syncfs calls made
+        self.items = 0
+        self.syncs = 0
+        self.fsyncs = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return "<DurabilityStats %d items, %d syncs, %d fsyncs, %.3fs>" % (
+            self.items,
+            self.syncs,
+            self.fsyncs,
+            self.seconds,
+        )
+
+
+def sync_trash(trash_dir, names, stats):
+    # One sync of the filesystem of the trash covers the .trashinfo files of
+    # all the entries, the data copied into files/ and both directories.
+    sync_filesystem(trash_dir)
+    stats.fsyncs += 1
+    stats.items += len(names)
+
+
+class PlannedItem:
+    """A path checked by :meth:`TrashBatch.plan`.
+
+    ``error`` is the exception that makes it impossible to trash the path,
+    otherwise the other attributes hold everything needed to trash it.
+    ``trashed`` is True for paths a journal shows were already trashed.
+    ``scan`` is the :class:`~send2trash.crossdev.TreeScan` of a directory
+    planned in tree mode to be copied to another device.
+    """
+
+    __slots__ = ("path", "path_b", "st", "dev", "real_path", "src_dir_fd", "location", "error", "trashed", "scan")
+
+    def __init__(self, path):
+        self.path = path
+        self.path_b = self.st = self.dev = self.real_path = self.src_dir_fd = self.location = self.error = None
+        self.trashed = False
+        self.scan = None
+
+    @property
+    def is_dir(self):
+        return self.st is not None and stat.S_ISDIR(self.st.st_mode)
+
+
+class TrashPlan:
+    """The :class:`PlannedItem` of each path given to :meth:`TrashBatch.plan`."""
+
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def valid(self):
+        return [item for item in self.items if item.error is None]
+
+    @property
+    def errors(self):
+        return [(item.path, item.error) for item in self.items if item.error is not None]
+
+    def raise_first(self):
+        for item in self.items:
+            if item.error is not None:
+                raise item.error
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# Paths planned together by send2trash(), bounding the directories held open
+PLAN_CHUNK_SIZE = 256
+# Resolved parent directories remembered by a batch
+REALPATH_CACHE_SIZE = 1024
+
+
+class TrashBatch:
+    """State shared by all the paths of one bulk operation.
+
+    Trash locations come from the process wide ``trash_cache`` so files on
+    the same mount are resolved once and the ``files``/``info`` directories
+    are created once per trash instead of once per path. A batch may be
+    shared between threads.
+
+    Sizes of directories copied from another device, known from their scan,
+    are added to the directorysizes cache of their trash by :meth:`flush`,
+    called when the batch is used as a context manager, so that the cache is
+    rewritten once per batch. Renamed directories aren't walked for their
+    size, readers of the cache compute the missing entries.
+
+    A ``durable`` batch makes sure its .trashinfo files and renames are on
+    disk at each sync point: every ``sync_every`` items and on :meth:`flush`.
+    Syncing is done once per trash filesystem rather than per item, see
+    :func:`sync_trash`, and accounted in ``durability``. Items trashed since
+    the last sync point may still be lost, or have an empty .trashinfo,
+    after a crash. Copies from another device are synced the same way before
+    their source is removed, so a crash never loses their data.
+
+    ``progress``, if given, is called with a
+    :class:`~send2trash.progress.ProgressEvent` as each path is checked,
+    started and finished, for each phase and for the bytes copied when a path
+    has to be moved to another device.
+
+    In ``tree`` mode, directories whose trash is on another device are
+    scanned in parallel when planned and fail the plan if anything in them
+    can't be read or removed, instead of failing halfway through their copy;
+    the scan is then reused by the copy. Directories renamed into their
+    trash aren't scanned. Copies to another device are also resumable: an
+    interrupted one is kept in the trash and the next attempt only copies
+    what it lacks.
+
+    A ``journal`` batch records its moves in a :class:`Journal` per trash
+    directory. Its first :meth:`plan` recovers the journals of the processes
+    that died, and the missing paths these show were trashed are planned as
+    already done: a job interrupted by a crash can be run again as is.
+    """
+
+    def __init__(
+        self, cache=None, durable=False, sync_every=DURABLE_SYNC_EVERY, progress=None, tree=False, journal=False
+    ):
+        self.cache = trash_cache if cache is None else cache
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.directory_sizes = {}
+        # Totals of the copies done for cross device moves
+        self.copy_stats = crossdev.CopyStats()
+        self.durable = durable
+        self.tree = tree
+        self.journal = journal
+        self.journals = {}
+        # Source paths trashed according to the recovered journals
+        self.recovered = None
+        self.sync_every = sync_every
+        self.unsynced = {}
+        self.unsynced_count = 0
+        self.durability = DurabilityStats()
+        self.local = threading.local()
+        self.realpaths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            directory_sizes, self.directory_sizes = self.directory_sizes, {}
+        for trash_dir, updates in directory_sizes.items():
+            try:
+                with tracing.span("directorysizes"):
+                    update_directorysizes(trash_dir, updates)
+            except OSError:
+                # Only a cache, readers recompute missing entries
+                pass
+        if self.durable:
+            self.sync()
+        with self.lock:
+            journals, self.journals = self.journals, {}
+        for journal in journals.values():
+            journal.close()
+
+    def sync(self):
+        """Get all the items trashed so far on disk."""
+        with self.lock:
+            unsynced, self.unsynced = self.unsynced, {}
+            self.unsynced_count = 0
+        if not unsynced:
+            return
+        start = time.monotonic()
+        fsyncs = self.durability.fsyncs
+        with self.lock:
+            journals = list(self.journals.values())
+        try:
+            with tracing.span("sync"):
+                for journal in journals:
+                    journal.sync()
+                    self.durability.fsyncs += 1
+                for trash_dir, names in unsynced.items():
+                    sync_trash(trash_dir, names, self.durability)
+                tracing.syscall("fsync", self.durability.fsyncs - fsyncs)
+        finally:
+            self.durability.syncs += 1
+            self.durability.seconds += time.monotonic() - start
+
+    def source_dir(self, path, parent_st=None):
+        """Return a :class:`DirFd` on the parent of ``path``, or None.
+
+        The last parent used is kept open (per thread) so that consecutive
+        paths from the same directory are looked up relative to it. It is only
+        reused while the parent path still leads to it, as checked with
+        ``parent_st``, the stat of the parent if already known: a renamed or
+        replaced directory is opened again.
+        """
+        if not USE_DIR_FD:
+            return None
+        parent = op.dirname(path) or b"."
+        cached = getattr(self.local, "source_dir", None)
+        if cached is not None and cached[0] == parent:
+            if parent_st is None:
+                tracing.syscall("stat")
+                parent_st = os.stat(parent)
+            if (parent_st.st_dev, parent_st.st_ino) == cached[2]:
+                return cached[1]
+        tracing.syscall("open")
+        dir_fd = DirFd(parent)
+        st = os.fstat(dir_fd.fd)
+        self.local.source_dir = (parent, dir_fd, (st.st_dev, st.st_ino))
+        return dir_fd
+
+    def real_path(self, path, parent_st=None):
+        # realpath() of the parent, which is shared by many paths, and not of
+        # the path itself: a trashed symlink is the link, not its target. The
+        # cached one is only used while the parent is the same directory.
+        parent, name = op.split(op.abspath(path))
+        if parent_st is None:
+            tracing.syscall("stat")
+            parent_st = os.stat(parent)
+        parent_id = (parent_st.st_dev, parent_st.st_ino)
+        real_parent, cached_id = self.realpaths.get(parent, (None, None))
+        if real_parent is None or cached_id != parent_id:
+            if len(self.realpaths) >= REALPATH_CACHE_SIZE:
+                self.realpaths.clear()
+            tracing.syscall("realpath")
+            real_parent = op.realpath(parent)
+            self.realpaths[parent] = (real_parent, parent_id)
+        return op.join(real_parent, name)
+
+    def plan_item(self, item):
+        path = item.path
         if isinstance(path, str):
             path_b = fsencode(path)
         elif isinstance(path, bytes):
             path_b = path
         else:
             raise TypeError("str, bytes or PathLike expected, not %r" % type(path))
+        item.path_b = path_b
 
-        if not op.exists(path_b):
+        # Checks and rename are relative to the parent directory, so that it
+        # can't be swapped between them.
+        try:
+            tracing.syscall("stat")
+            parent_st = os.stat(op.dirname(path_b) or b".")
+            item.src_dir_fd = self.source_dir(path_b, parent_st)
+        except OSError:
+            raise OSError(errno.ENOENT, "File not found: %s" % path)
+        if item.src_dir_fd is None:
+            name, dir_fd = path_b, None
+        else:
+            name, dir_fd = op.basename(path_b), item.src_dir_fd.fd
+
+        # The only stat of the path: existence, device and type all come from it
+        tracing.syscall("lstat")
+        try:
+            item.st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+        except OSError:
             raise OSError(errno.ENOENT, "File not found: %s" % path)
         # ...should check whether the user has the necessary permissions to delete
         # it, before starting the trashing operation itself. [2]
-        if not os.access(path_b, os.W_OK):
+        # A symlink is trashed as is, whether its target exists or not.
+        tracing.syscall("access")
+        if not os.access(name, os.W_OK, dir_fd=dir_fd, follow_symlinks=False):
             raise OSError(errno.EACCES, "Permission denied: %s" % path)
 
-        path_dev = get_dev(path_b)
-        # If XDG_DATA_HOME or HOMETRASH do not yet exist we need to stat the
-        # home directory, and these paths will be created further on if needed.
-        trash_dev = get_dev(op.expanduser(b"~"))
+        item.dev = stat_dev(path_b, item.st)
+        item.real_path = self.real_path(path_b, parent_st)
+        item.location = self.cache.lookup(item.real_path, item.dev)
+        if self.tree and stat.S_ISDIR(item.st.st_mode) and item.location.dev != item.dev:
+            # To be copied: everything in it has to be readable and removable
+            with tracing.span("scan_tree", path):
+                item.scan = crossdev.scan_path(path_b)
+            if item.scan.errors:
+                raise item.scan.errors[0]
 
-        # if the file to be trashed is on the same device as HOMETRASH we
-        # want to move it there.
-        if path_dev == trash_dev:
-            topdir = XDG_DATA_HOME
-            dest_trash = HOMETRASH_B
-        else:
-            topdir = find_mount_point(path_b)
-            trash_dev = get_dev(topdir)
-            if trash_dev != path_dev:
-                raise OSError("Couldn't find mount point for %s" % path)
-            dest_trash = find_ext_volume_trash(topdir)
+    def plan(self, paths):
+        """Check ``paths`` and find their trash, return a :class:`TrashPlan`.
+
+        Errors are recorded in the plan rather than raised.
+        """
+        if self.journal and self.recovered is None:
+            self.recover()
+        items = []
+        for path in paths:
+            item = PlannedItem(path)
+            try:
+                with report.phase(self.progress, path, report.RESOLVE), tracing.span("resolve", path):
+                    self.plan_item(item)
+            except Exception as error:
+                if self.recovered and item.path_b is not None and op.abspath(item.path_b) in self.recovered:
+                    item.trashed = True
+                else:
+                    item.error = error
+                    report.finished(self.progress, path, error)
+            items.append(item)
+        return TrashPlan(items)
+
+    def recover(self):
+        """Recover the journals of all the trash directories, return a :class:`Recovery`."""
+        from send2trash import manage
+
+        with tracing.span("recover"):
+            recovery = manage.recover()
+        self.recovered = set(recovery.trashed)
+        return recovery
+
+    def journal_for(self, location):
+        with self.lock:
+            journal = self.journals.get(location.dest_trash)
+            if journal is None:
+                journal = self.journals[location.dest_trash] = Journal(location.dest_trash)
+            return journal
+
+    def item_progress(self, path):
+        # Events of trash_move() are about path as given, not as bytes
+        progress = self.progress
+        if progress is None:
+            return None
+        return lambda event: progress(event._replace(path=path))
+
+    def move(
+        self, path, location, cross_dev=False, is_dir=False, src_dir_fd=None, info=None, progress=None, scan=None
+    ):
+        if not location.prepared:
+            location.prepare()
+        if cross_dev and is_dir and scan is None:
+            # Copied anyway, the scan also gives the size for directorysizes
+            with tracing.span("scan_tree", path):
+                scan = crossdev.scan_path(path)
+        destname = trash_move(
+            path,
+            location.dest_trash,
+            location.topdir,
+            cross_dev=cross_dev,
+            prepared=True,
+            copy_stats=self.copy_stats,
+            dir_fds=location.dir_fds,
+            src_dir_fd=src_dir_fd,
+            info=info,
+            progress=progress,
+            resume=self.tree,
+            journal=self.journal_for(location) if self.journal else None,
+            scan=scan,
+            sync=self.durable,
+        )
+        if self.durable:
+            with self.lock:
+                self.unsynced.setdefault(location.dest_trash, []).append(destname)
+                self.unsynced_count += 1
+                sync = self.unsynced_count >= self.sync_every
+            if sync:
+                self.sync()
+        if scan is not None:
+            try:
+                size = directory_size_entry(location.dest_trash, destname, scan.size)
+            except OSError:
+                return
+            with self.lock:
+                self.directory_sizes.setdefault(location.dest_trash, {})[destname] = size
+
+    def move_item(self, item, location, cross_dev=False):
+        info = format_info(info_path(item.real_path, location.real_topdir))
+        src_dir_fd = None if cross_dev else item.src_dir_fd
+        progress = self.item_progress(item.path)
+        self.move(
+            item.path_b,
+            location,
+            cross_dev=cross_dev,
+            is_dir=item.is_dir,
+            src_dir_fd=src_dir_fd,
+            info=info,
+            progress=progress,
+            scan=item.scan if cross_dev else None,
+        )
+
+    def execute(self, item):
+        """Trash a valid :class:`PlannedItem`."""
+        if self.progress is None:
+            with tracing.span("trash", item.path):
+                self._execute(item)
+            return
+        report.started(self.progress, item.path)
+        try:
+            with tracing.span("trash", item.path):
+                self._execute(item)
+        except Exception as error:
+            report.finished(self.progress, item.path, error)
+            raise
+        report.finished(self.progress, item.path)
+
+    def _execute(self, item):
+        if item.trashed:
+            return
+        location = item.location
+        cached = location.prepared
         try:
-            trash_move(path_b, dest_trash, topdir)
+            try:
+                self.move_item(item, location)
+            except OSError as error:
+                # A trash used earlier may have been removed or replaced since
+                # it was checked, check again and retry once.
+                if error.errno == errno.EXDEV or not cached or not self.cache.invalidate(location):
+                    raise
+                location = item.location = self.cache.lookup(item.real_path, item.dev)
+                self.move_item(item, location)
         except OSError as error:
             # Cross link errors default back to HOMETRASH
             if error.errno == errno.EXDEV:
-                trash_move(path_b, HOMETRASH_B, XDG_DATA_HOME, cross_dev=True)
+                self.move_item(item, self.cache.lookup_home(), cross_dev=True)
             else:
                 raise
+
+    def trash(self, path):
+        [item] = self.plan([path])
+        if item.error is not None:
+            raise item.error
+        self.execute(item)
+
+
+def send2trash(paths, progress=None):
+    with TrashBatch(progress=progress) as batch:
+        # Paths are trashed in order up to the first one that fails, checks
+        # included, whatever the chunk it is in
+        for chunk in chunked_paths(paths, PLAN_CHUNK_SIZE):
+            for item in batch.plan(chunk):
+                if item.error is not None:
+                    raise item.error
+                batch.execute(item)
+
+
+def iter_send2trash(paths, workers=None, durable=False, progress=None, tree=False, journal=False, stop_on_error=False):
+    """Trash ``paths`` from a pool of ``workers`` threads, yielding a
+    ``(path, error)`` pair per path in input order.
+
+    ``paths`` can be any iterable: it is read ``PLAN_CHUNK_SIZE`` paths at a
+    time, and the next chunk only once the results of the previous one were
+    consumed, so that memory use stays flat however many paths go through.
+    ``error`` is None for paths that were trashed, the raised exception
+    otherwise; every path is attempted, unless ``stop_on_error``: paths are
+    then trashed one at a time and the iteration ends with the first error,
+    leaving the paths after it alone. ``workers`` defaults to the
+    :class:`ThreadPoolExecutor` default. With ``durable``, everything trashed
+    is on disk once the iteration is over (see :class:`TrashBatch`).
+    ``progress``, ``tree`` and ``journal`` are as for :class:`TrashBatch`.
+    """
+    batch = TrashBatch(durable=durable, progress=progress, tree=tree, journal=journal)
+
+    def execute(item):
+        if item.error is None:
+            try:
+                batch.execute(item)
+            except Exception as error:
+                item.error = error
+        return item
+
+    with batch, ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunked_paths(paths, PLAN_CHUNK_SIZE):
+            plan = batch.plan(chunk)
+            sequential = workers == 1 or stop_on_error
+            items = map(execute, plan) if sequential else executor.map(execute, plan)
+            for item in items:
+                yield item.path, item.error
+                if stop_on_error and item.error is not None:
+                    return
+
+
+def send2trash_many(paths, workers=None, durable=False, progress=None, tree=False, journal=False):
+    """Trash ``paths`` from a pool of ``workers`` threads.
+
+    Unlike :func:`send2trash` this does not stop at the first error: every
+    path is attempted and the returned :class:`~send2trash.util.TrashResult`
+    tells, for each of them, whether it was trashed or which exception was
+    raised. See :func:`iter_send2trash` for the arguments.
+    """
+    result = TrashResult()
+    for path, error in iter_send2trash(paths, workers, durable, progress, tree, journal):
+        result.add(path, error)
+    return result
@@ -0,0 +1,133 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# Progress reporting shared by all the backends. Every send2trash() accepts a
+# ``progress`` callable which is called with a ProgressEvent as trashing goes;
+# nothing is computed when it is None.
+
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Kinds of events
+STARTED = "started"  # path is about to be trashed
+FINISHED = "finished"  # path was trashed (error is None) or failed (error is set)
+COPIED = "copied"  # bytes of path were copied to another device
+PHASE = "phase"  # a phase of trashing path took seconds
+
+# Phases reported by plat_other, other backends only report "trash"
+RESOLVE = "resolve"  # checking the path and finding its trash
+INFO = "info"  # writing the .trashinfo file
+RENAME = "rename"
+COPY = "copy"  # cross device move
+TRASH = "trash"  # the whole operation, when it can't be split
+
+ProgressEvent = namedtuple("ProgressEvent", ["kind", "path", "phase", "seconds", "bytes", "error"])
+ProgressEvent.__new__.__defaults__ = (None, None, None, None)
+
+
+def started(progress, path):
+    if progress is not None:
+        progress(ProgressEvent(STARTED, path))
+
+
+def finished(progress, path, error=None):
+    if progress is not None:
+        progress(ProgressEvent(FINISHED, path, error=error))
+
+
+@contextmanager
+def phase(progress, path, name):
+    """Report the time spent in the ``with`` block as phase ``name`` of ``path``.
+
+    Does nothing when ``progress`` is None.
+    """
+    if progress is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        progress(ProgressEvent(PHASE, path, phase=name, seconds=time.monotonic() - start))
+
+
+@contextmanager
+def trashing(progress, path):
+    """Report ``path`` as started, its "trash" phase and as finished around the
+    ``with`` block, for backends trashing paths one by one in a single call.
+    """
+    if progress is None:
+        yield
+        return
+    started(progress, path)
+    try:
+        with phase(progress, path, TRASH):
+            yield
+    except Exception as error:
+        finished(progress, path, error)
+        raise
+    finished(progress, path)
+
+
+def copied(progress, path):
+    # Callback for the copies of crossdev.move(), called with each file size
+    if progress is None:
+        return None
+    return lambda size: progress(ProgressEvent(COPIED, path, bytes=size))
+
+
+class Metrics:
+    """A ``progress`` callable keeping totals, e.g. to export them as metrics.
+
+    Safe to share between threads and between operations. ``slowest`` keeps
+    the path with the longest single phase, which points at slow mounts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes_copied = 0
+        # Total seconds and number of occurrences per phase
+        self.phase_seconds = {}
+        self.phase_counts = {}
+        self.errors = {}
+        self.slowest = (None, None, 0.0)
+
+    def __call__(self, event):
+        with self.lock:
+            if event.kind == STARTED:
+                self.started += 1
+            elif event.kind == FINISHED:
+                if event.error is None:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                    name = type(event.error).__name__
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            elif event.kind == COPIED:
+                self.bytes_copied += event.bytes
+            elif event.kind == PHASE:
+                self.phase_seconds[event.phase] = self.phase_seconds.get(event.phase, 0.0) + event.seconds
+                self.phase_counts[event.phase] = self.phase_counts.get(event.phase, 0) + 1
+                if event.seconds > self.slowest[2]:
+                    self.slowest = (event.path, event.phase, event.seconds)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "bytes_copied": self.bytes_copied,
+                "phase_seconds": dict(self.phase_seconds),
+                "phase_counts": dict(self.phase_counts),
+                "errors": dict(self.errors),
+            }
+
+    def __repr__(self):
+        return "<Metrics %d succeeded, %d failed, %d bytes copied>" % (self.succeeded, self.failed, self.bytes_copied)
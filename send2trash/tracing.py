@@ -0,0 +1,227 @@
+# This software is licensed under the "BSD" License as described in the "LICENSE" file,
+# which should be included with this package. The terms are also available at
+# http://www.hardcoded.net/licenses/bsd_license
+
+# Optional instrumentation of the plat_other hot paths. plat_other wraps its
+# phases in span() and counts its system calls with syscall(); both do nothing
+# but check a global unless a Tracer was enabled with trace() or enable().
+#
+#     with tracing.trace() as tracer:
+#         send2trash(paths)
+#     tracer.summary()  # per phase timings, per path syscall counts
+#     tracer.spans()    # OpenTelemetry style span dicts
+
+import itertools
+import os
+import threading
+import time
+
+# The enabled Tracer, None when tracing is off
+_tracer = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, path=None):
+    """Return a context manager timing phase ``name`` (of ``path``, if given)."""
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, path)
+
+
+def syscall(name, count=1):
+    """Count ``count`` calls to the system call ``name`` in the current span."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.syscall(name, count)
+
+
+class Span:
+    """A timed phase, entered and exited on a single thread.
+
+    ``path`` is inherited from the enclosing span when not given, so system
+    calls of nested phases are counted against the path being trashed.
+    """
+
+    __slots__ = ("tracer", "name", "path", "span_id", "parent_id", "start", "end", "syscalls", "error")
+
+    def __init__(self, tracer, name, path):
+        self.tracer = tracer
+        self.name = name
+        self.path = path
+        self.span_id = next(tracer.ids)
+        self.parent_id = None
+        self.start = self.end = None
+        self.syscalls = {}
+        self.error = None
+
+    @property
+    def seconds(self):
+        return (self.end - self.start) / 1e9
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if stack:
+            parent = stack[-1]
+            self.parent_id = parent.span_id
+            if self.path is None:
+                self.path = parent.path
+        stack.append(self)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.time_ns()
+        if exc_value is not None:
+            self.error = exc_value
+        self.tracer.stack().pop()
+        self.tracer.finish(self)
+        return False
+
+    def __repr__(self):
+        return "<Span %s %.6fs>" % (self.name, self.seconds if self.end is not None else 0.0)
+
+
+def display_path(path):
+    return os.fsdecode(path) if isinstance(path, bytes) else path
+
+
+class Tracer:
+    """Collects the spans and system call counts of everything trashed while
+    enabled, from all threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.trace_id = os.urandom(16).hex()
+        self.finished = []
+        # {path: {syscall: count}}, None being calls made outside of any path
+        self.path_syscalls = {}
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+            return stack
+
+    def span(self, name, path=None):
+        return Span(self, name, path)
+
+    def syscall(self, name, count=1):
+        stack = self.stack()
+        path = None
+        if stack:
+            current = stack[-1]
+            current.syscalls[name] = current.syscalls.get(name, 0) + count
+            path = current.path
+        with self.lock:
+            counts = self.path_syscalls.setdefault(path, {})
+            counts[name] = counts.get(name, 0) + count
+
+    def finish(self, span):
+        with self.lock:
+            self.finished.append(span)
+
+    def summary(self):
+        """Return a dict with, for each phase, its count and total, min, max
+        and mean seconds, and the system call counts in total and per path.
+        """
+        with self.lock:
+            spans = list(self.finished)
+            path_syscalls = {path: dict(counts) for path, counts in self.path_syscalls.items()}
+        phases = {}
+        for span in spans:
+            seconds = span.seconds
+            phase = phases.get(span.name)
+            if phase is None:
+                phases[span.name] = {"count": 1, "total": seconds, "min": seconds, "max": seconds}
+            else:
+                phase["count"] += 1
+                phase["total"] += seconds
+                phase["min"] = min(phase["min"], seconds)
+                phase["max"] = max(phase["max"], seconds)
+        for phase in phases.values():
+            phase["mean"] = phase["total"] / phase["count"]
+        syscalls = {}
+        for counts in path_syscalls.values():
+            for name, count in counts.items():
+                syscalls[name] = syscalls.get(name, 0) + count
+        return {
+            "phases": phases,
+            "syscalls": syscalls,
+            "paths": {display_path(path): counts for path, counts in path_syscalls.items() if path is not None},
+        }
+
+    def spans(self):
+        """Return the finished spans as dicts laid out like OpenTelemetry
+        (OTLP/JSON) spans, ordered by start time.
+        """
+        with self.lock:
+            spans = sorted(self.finished, key=lambda span: span.start)
+        result = []
+        for span in spans:
+            attributes = {"send2trash.syscalls." + name: count for name, count in span.syscalls.items()}
+            if span.path is not None:
+                attributes["send2trash.path"] = display_path(span.path)
+            status = {"code": "STATUS_CODE_UNSET"}
+            if span.error is not None:
+                status = {"code": "STATUS_CODE_ERROR", "message": repr(span.error)}
+            result.append(
+                {
+                    "traceId": self.trace_id,
+                    "spanId": "%016x" % span.span_id,
+                    "parentSpanId": "%016x" % span.parent_id if span.parent_id is not None else "",
+                    "name": span.name,
+                    "startTimeUnixNano": span.start,
+                    "endTimeUnixNano": span.end,
+                    "attributes": attributes,
+                    "status": status,
+                }
+            )
+        return result
+
+
+def enable(tracer=None):
+    """Start tracing into ``tracer`` (a new :class:`Tracer` by default), return it."""
+    global _tracer
+    _tracer = Tracer() if tracer is None else tracer
+    return _tracer
+
+
+def disable():
+    """Stop tracing, return the tracer that was enabled (or None)."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+class trace:
+    """Context manager tracing its block into a new :class:`Tracer`."""
+
+    def __init__(self):
+        self.tracer = Tracer()
+
+    def __enter__(self):
+        self.previous = _tracer
+        enable(self.tracer)
+        return self.tracer
+
+    def __exit__(self, *exc_info):
+        global _tracer
+        _tracer = self.previous
+        return False
@@ -6,6 +6,10 @@
 # http://www.hardcoded.net/licenses/bsd_license
 
 import collections.abc
+import errno
+import os
+import stat
+from itertools import islice
 
 
 def preprocess_paths(paths):
@@ -16,3 +20,251 @@ def preprocess_paths(paths):
     # Convert items such as pathlib paths to strings
     paths = [path.__fspath__() if hasattr(path, "__fspath__") else path for path in paths]
     return paths
+
+
+def iter_paths(paths):
+    """Lazy :func:`preprocess_paths`: yield the paths one at a time.
+
+    ``paths`` is a single path or any iterable of paths, generators included,
+    which is only advanced as the paths are consumed.
+    """
+    if not isinstance(paths, collections.abc.Iterable) or isinstance(paths, (str, bytes)):
+        paths = (paths,)
+    for path in paths:
+        yield path.__fspath__() if hasattr(path, "__fspath__") else path
+
+
+def chunked_paths(paths, size):
+    """Yield the paths of :func:`iter_paths` in lists of at most ``size``.
+
+    The next chunk is only read from ``paths`` once the previous one was
+    consumed, so that memory use doesn't depend on the number of paths.
+    """
+    paths = iter_paths(paths)
+    while True:
+        chunk = list(islice(paths, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def tree_usage(path):
+    """Return the number of non-directories and their total size in bytes.
+
+    ``path`` can be a file or a directory, which is walked without following
+    symlinks.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        return 1, st.st_size
+    files = total = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    files += 1
+                    total += entry.stat(follow_symlinks=False).st_size
+    return files, total
+
+
+def tree_size(path):
+    """Return the apparent size in bytes of ``path`` and everything below it."""
+    return tree_usage(path)[1]
+
+
+# libc's renameat2(), looked up on first use, None when unavailable
+_renameat2 = False
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+
+def renameat2_noreplace(src, dst):
+    # Return False if renameat2() or its RENAME_NOREPLACE flag is unsupported
+    global _renameat2
+    if _renameat2 is False:
+        try:
+            import ctypes
+
+            _renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+        except (ImportError, OSError, AttributeError):
+            _renameat2 = None
+    if _renameat2 is None:
+        return False
+    if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) != 0:
+        import ctypes
+
+        err = ctypes.get_errno()
+        if err in (errno.ENOSYS, errno.EINVAL):
+            return False
+        raise OSError(err, os.strerror(err), dst)
+    return True
+
+
+def rename_noreplace(src, dst):
+    """Rename ``src`` to ``dst``, raise :class:`FileExistsError` if ``dst`` exists.
+
+    Where renameat2() can't do it atomically, a non-directory is hard linked
+    to ``dst`` then unlinked, and a directory replaces an empty directory
+    that ``mkdir()`` created at ``dst`` beforehand.
+    """
+    if renameat2_noreplace(src, dst):
+        return
+    if not stat.S_ISDIR(os.lstat(src).st_mode):
+        os.link(src, dst, follow_symlinks=False)
+        os.unlink(src)
+        return
+    os.mkdir(dst, 0o700)
+    try:
+        os.rename(src, dst)
+    except BaseException:
+        try:
+            os.rmdir(dst)
+        except OSError:
+            pass
+        raise
+
+
+# libc's syncfs(), looked up on first use, None when unavailable
+_syncfs = False
+
+
+def syncfs(fd):
+    # Return False if syncfs() is unsupported
+    global _syncfs
+    if _syncfs is False:
+        try:
+            import ctypes
+
+            _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+        except (ImportError, OSError, AttributeError):
+            _syncfs = None
+    if _syncfs is None:
+        return False
+    if _syncfs(fd) != 0:
+        import ctypes
+
+        err = ctypes.get_errno()
+        if err == errno.ENOSYS:
+            return False
+        raise OSError(err, os.strerror(err))
+    return True
+
+
+def sync_filesystem(path):
+    """Get everything written to the filesystem holding directory ``path`` on disk.
+
+    A single syncfs() flushes the data and metadata of all the files written
+    there, however many. Where it is unavailable, :func:`os.sync` flushes
+    every filesystem instead.
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        if syncfs(fd):
+            return
+    finally:
+        os.close(fd)
+    os.sync()
+
+
+def scan_remove(path):
+    # Unlink path, or the non-directory children of it if it is a directory.
+    # Returns None for non-directories, the subdirectories left otherwise.
+    try:
+        if not stat.S_ISDIR(os.lstat(path).st_mode):
+            os.unlink(path)
+            return None
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+        return subdirs
+    except FileNotFoundError:
+        return None
+    except OSError as error:
+        return error
+
+
+def remove_dir(path):
+    try:
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        return error
+    return None
+
+
+def remove_trees(paths, executor):
+    """Remove ``paths``, which can be files or whole directory trees.
+
+    The directories of each depth level of all the trees are emptied in
+    parallel on ``executor``, then removed deepest level first. Returns a list
+    with, for each path, None or the first error that stopped its removal.
+    """
+    errors = [None] * len(paths)
+    level = list(enumerate(paths))
+    levels = []
+    while level:
+        dirs = []
+        next_level = []
+        for (root, path), outcome in zip(level, executor.map(scan_remove, [path for _, path in level])):
+            if isinstance(outcome, OSError):
+                errors[root] = errors[root] or outcome
+            elif outcome is not None:
+                dirs.append((root, path))
+                next_level.extend((root, subdir) for subdir in outcome)
+        levels.append(dirs)
+        level = [(root, path) for root, path in next_level if errors[root] is None]
+    for dirs in reversed(levels):
+        dirs = [(root, path) for root, path in dirs if errors[root] is None]
+        for (root, _), error in zip(dirs, executor.map(remove_dir, [path for _, path in dirs])):
+            if error is not None:
+                errors[root] = errors[root] or error
+    return errors
+
+
+class TrashResult:
+    """Outcome of a bulk trash operation, one ``(path, error)`` pair per path.
+
+    ``error`` is ``None`` for paths that were trashed and the raised exception
+    for the others. Items are kept in input order.
+    """
+
+    def __init__(self):
+        self.items = []
+
+    def add(self, path, error=None):
+        self.items.append((path, error))
+
+    @property
+    def succeeded(self):
+        return [path for path, error in self.items if error is None]
+
+    @property
+    def failed(self):
+        return [(path, error) for path, error in self.items if error is not None]
+
+    @property
+    def ok(self):
+        return all(error is None for _, error in self.items)
+
+    def raise_first(self):
+        """Raise the error of the first failed path, if any."""
+        for _, error in self.items:
+            if error is not None:
+                raise error
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return "<TrashResult %d succeeded, %d failed>" % (len(self.succeeded), len(self.failed))
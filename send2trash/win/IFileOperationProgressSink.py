@@ -1,10 +1,12 @@
-# Sample implementation of IFileOperationProgressSink that just prints
-# some basic info
+# Implementation of IFileOperationProgressSink forwarding item progress to a
+# send2trash progress callable
 
 import pythoncom
 from win32com.shell import shell, shellcon
 from win32com.server.policy import DesignatedWrapPolicy
 
+from send2trash import progress as report
+
 
 class FileOperationProgressSink(DesignatedWrapPolicy):
     _com_interfaces_ = [shell.IID_IFileOperationProgressSink]
@@ -27,20 +29,27 @@ class FileOperationProgressSink(DesignatedWrapPolicy):
         "ResumeTimer",
     ]
 
-    def __init__(self):
+    def __init__(self, progress=None):
         self._wrap_(self)
         self.newItem = None
+        self.progress = progress
 
     def PreDeleteItem(self, flags, item):
+        if self.progress is not None:
+            report.started(self.progress, item.GetDisplayName(shellcon.SHGDN_FORPARSING))
         # Can detect cases where to stop via flags and condition below, however the operation
         # does not actual stop, we can resort to raising an exception as that does stop things
         # but that may need some additional considerations before implementing.
         return 0 if flags & shellcon.TSF_DELETE_RECYCLE_IF_POSSIBLE else 0x80004005  # S_OK, or E_FAIL
 
     def PostDeleteItem(self, flags, item, hr_delete, newly_created):
+        if self.progress is not None:
+            path = item.GetDisplayName(shellcon.SHGDN_FORPARSING)
+            error = OSError(None, "Failed to trash item", path, hr_delete) if hr_delete else None
+            report.finished(self.progress, path, error)
         if newly_created:
             self.newItem = newly_created.GetDisplayName(shellcon.SHGDN_FORPARSING)
 
 
-def create_sink():
-    return pythoncom.WrapObject(FileOperationProgressSink(), shell.IID_IFileOperationProgressSink)
+def create_sink(progress=None):
+    return pythoncom.WrapObject(FileOperationProgressSink(progress), shell.IID_IFileOperationProgressSink)
@@ -7,7 +7,8 @@
 from __future__ import unicode_literals
 import os.path as op
 
-from send2trash.util import preprocess_paths
+from send2trash import progress as report
+from send2trash.util import chunked_paths
 
 from ctypes import (
     windll,
@@ -137,10 +138,16 @@ def get_short_path_name(long_name):
     return get_awaited_path_from_prefix(prefix, output.value)
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    if not paths:
-        return
+# Paths given to each SHFileOperation call, so that any number can be streamed
+CHUNK_SIZE = 1024
+
+
+def send2trash(paths, progress=None):
+    for chunk in chunked_paths(paths, CHUNK_SIZE):
+        send2trash_chunk(chunk, progress)
+
+
+def send2trash_chunk(paths, progress=None):
     # convert data type
     paths = [str(path, "mbcs") if not isinstance(path, str) else path for path in paths]
     # convert to full paths
@@ -176,7 +183,15 @@ def send2trash(paths):
     fileop.fAnyOperationsAborted = 0
     fileop.hNameMappings = 0
     fileop.lpszProgressTitle = None
+    # All the paths are trashed by a single call, which succeeds or fails as a whole
+    for path in paths:
+        report.started(progress, path)
     result = SHFileOperationW(byref(fileop))
+    error = None
     if result:
-        error = convert_sh_file_opt_result(result)
-        raise WindowsError(None, FormatError(error), paths, error)
+        code = convert_sh_file_opt_result(result)
+        error = WindowsError(None, FormatError(code), paths, code)
+    for path in paths:
+        report.finished(progress, path, error)
+    if error is not None:
+        raise error
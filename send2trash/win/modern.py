@@ -6,7 +6,7 @@
 
 from __future__ import unicode_literals
 import os.path as op
-from send2trash.util import preprocess_paths
+from send2trash.util import chunked_paths
 from platform import version
 import pythoncom
 import pywintypes
@@ -14,10 +14,16 @@ from win32com.shell import shell, shellcon
 from send2trash.win.IFileOperationProgressSink import create_sink
 
 
-def send2trash(paths):
-    paths = preprocess_paths(paths)
-    if not paths:
-        return
+# Paths queued on each IFileOperation, so that any number can be streamed
+CHUNK_SIZE = 1024
+
+
+def send2trash(paths, progress=None):
+    for chunk in chunked_paths(paths, CHUNK_SIZE):
+        send2trash_chunk(chunk, progress)
+
+
+def send2trash_chunk(paths, progress=None):
     # convert data type
     paths = [str(path, "mbcs") if not isinstance(path, str) else path for path in paths]
     # convert to full paths
@@ -46,7 +52,7 @@ def send2trash(paths):
     # actually try to perform the operation, this section may throw a
     # pywintypes.com_error which does not seem to create as nice of an
     # error as OSError so wrapping with try to convert
-    sink = create_sink()
+    sink = create_sink(progress)
     try:
         for path in paths:
             item = shell.SHCreateItemFromParsingName(path, None, shell.IID_IShellItem)
@@ -0,0 +1,55 @@
+# encoding: utf-8
+import os
+import shutil
+import sys
+from os import path as op
+from tempfile import NamedTemporaryFile, mkdtemp
+
+import pytest
+
+
+def touch(path):
+    with open(path, "a"):
+        os.utime(path, None)
+
+
+def remove_home_file(path):
+    # Remove path and, if it was trashed, its entry in the home trash
+    if sys.platform != "win32":
+        from send2trash.plat_other import HOMETRASH, INFO_SUFFIX
+
+        name = op.basename(path)
+        for trashed in (op.join(HOMETRASH, "files", name), op.join(HOMETRASH, "info", name + INFO_SUFFIX.decode())):
+            if op.exists(trashed):
+                os.remove(trashed)
+    if op.exists(path):
+        os.remove(path)
+
+
+@pytest.fixture
+def make_home_files():
+    """Return ``make(count, prefix)``, creating ``count`` files in the home directory.
+
+    The files are removed after the test, from the home trash too if they
+    were trashed.
+    """
+    created = []
+
+    def make(count, prefix="send2trash_test"):
+        files = [NamedTemporaryFile(dir=op.expanduser("~"), prefix=prefix, delete=False) for _ in range(count)]
+        [file.close() for file in files]
+        created.extend(file.name for file in files)
+        return [file.name for file in files]
+
+    yield make
+    for path in created:
+        remove_home_file(path)
+
+
+@pytest.fixture
+def tmpdir_b():
+    # A temporary directory as bytes; short enough for a Unix socket path
+    # in it, unlike tmp_path
+    tmpdir = mkdtemp(prefix="s2t")
+    yield os.fsencode(tmpdir)
+    shutil.rmtree(tmpdir)
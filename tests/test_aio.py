@@ -0,0 +1,80 @@
+# encoding: utf-8
+import asyncio
+import sys
+import threading
+import pytest
+from os import path as op
+
+from send2trash import aio
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+
+@pytest.fixture
+def files(make_home_files):
+    return make_home_files(6, prefix="send2trash_aio")
+
+
+def test_send2trash(files):
+    asyncio.run(aio.send2trash(files, concurrency=2))
+    assert not any(op.exists(file) for file in files)
+
+
+def test_send2trash_error(files):
+    missing = files[0] + "_missing"
+    pytest.raises(OSError, asyncio.run, aio.send2trash([missing]))
+
+
+def test_iter_send2trash(files):
+    async def collect():
+        return [event async for event in aio.iter_send2trash(files + [files[0]], concurrency=3)]
+
+    events = asyncio.run(collect())
+    assert sorted(event.path for event in events if event.error is None) == sorted(files)
+    assert [event.path for event in events if event.error is not None] == [files[0]]
+
+
+def test_iter_send2trash_close(files):
+    async def first():
+        events = aio.iter_send2trash(files, concurrency=1)
+        async for event in events:
+            await events.aclose()
+            return event
+
+    event = asyncio.run(first())
+    assert event.error is None
+    # Nothing is started once the iterator is closed
+    assert sum(op.exists(file) for file in files) == len(files) - 1
+
+
+def test_iter_send2trash_cancel_waits(monkeypatch):
+    started = threading.Semaphore(0)
+    release = threading.Event()
+    trashed = []
+    finished = []
+
+    def trash(path):
+        started.release()
+        release.wait(5)
+        trashed.append(path)
+
+    def finish():
+        finished.append((threading.current_thread(), list(trashed)))
+
+    monkeypatch.setattr(aio, "_get_trasher", lambda progress=None: (trash, finish))
+
+    async def cancel():
+        events = aio.iter_send2trash(["a", "b", "c"], concurrency=2)
+        task = asyncio.ensure_future(events.__anext__())
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [started.acquire() for _ in range(2)])
+        threading.Timer(0.1, release.set).start()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel())
+    # Run off the event loop, once the paths in flight were trashed
+    [(thread, done)] = finished
+    assert thread is not threading.main_thread()
+    assert sorted(done) == ["a", "b"]
@@ -0,0 +1,49 @@
+# encoding: utf-8
+import os
+import subprocess
+import sys
+import pytest
+
+import send2trash
+
+
+@pytest.fixture
+def restore_backend():
+    yield
+    send2trash.set_backend(None)
+
+
+def run_python(code, **env):
+    return subprocess.run(
+        [sys.executable, "-c", code], env=dict(os.environ, **env), capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def test_backend_not_imported_with_package():
+    code = "import sys, send2trash; print(sorted(m for m in sys.modules if m.startswith(('send2trash.', 'gi'))))"
+    assert run_python(code) == "['send2trash.exceptions']"
+
+
+@pytest.mark.skipif(sys.platform in ("win32", "darwin"), reason="Freedesktop backends only")
+def test_backend_forced_by_environment():
+    code = "import send2trash; print(send2trash.get_backend().__name__)"
+    assert run_python(code, SEND2TRASH_BACKEND="other") == "send2trash.plat_other"
+
+
+@pytest.mark.skipif(sys.platform in ("win32", "darwin"), reason="Freedesktop backends only")
+def test_set_backend(restore_backend):
+    from send2trash import plat_other
+
+    assert send2trash.set_backend("other") is plat_other
+    assert send2trash.get_backend() is plat_other
+    with pytest.raises(ValueError):
+        send2trash.set_backend("nope")
+
+
+@pytest.mark.skipif(sys.platform in ("win32", "darwin"), reason="Freedesktop backends only")
+def test_environment_read_on_demand(monkeypatch):
+    from send2trash import plat_other
+
+    monkeypatch.setenv("XDG_DATA_HOME", "/nonexistent/data")
+    assert plat_other.HOMETRASH == "/nonexistent/data/Trash"
+    assert plat_other.TOPDIR_FALLBACK == b".Trash-%d" % os.getuid()
@@ -0,0 +1,172 @@
+# encoding: utf-8
+import errno
+import os
+import sys
+import time
+import pytest
+from os import path as op
+from concurrent.futures import ThreadPoolExecutor
+
+from send2trash import crossdev
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+
+def make_tree(root):
+    os.makedirs(op.join(root, b"sub", b"subsub"))
+    for index, path in enumerate([b"a", b"sub/b", b"sub/subsub/c"]):
+        with open(op.join(root, path), "wb") as f:
+            f.write(b"data" * (index + 1) * 1000)
+    os.symlink(b"a", op.join(root, b"link"))
+    os.chmod(op.join(root, b"a"), 0o640)
+    os.utime(op.join(root, b"sub"), (1000000000, 1000000000))
+
+
+def test_move_tree(tmpdir_b):
+    src = op.join(tmpdir_b, b"src")
+    dst = op.join(tmpdir_b, b"dst")
+    make_tree(src)
+    stats = crossdev.move(src, dst, workers=2)
+    assert not op.lexists(src)
+    assert stats.files == 3
+    assert stats.bytes == 4000 + 8000 + 12000
+    with open(op.join(dst, b"sub", b"subsub", b"c"), "rb") as f:
+        assert f.read() == b"data" * 3000
+    assert os.readlink(op.join(dst, b"link")) == b"a"
+    assert os.stat(op.join(dst, b"a")).st_mode & 0o777 == 0o640
+    assert os.stat(op.join(dst, b"sub")).st_mtime == 1000000000
+
+
+def test_move_file_fallbacks(tmpdir_b, monkeypatch):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    src = op.join(tmpdir_b, b"src")
+    with open(src, "wb") as f:
+        f.write(b"x" * 100)
+    monkeypatch.setattr(crossdev, "clone", lambda src_fd, dst_fd: False)
+    monkeypatch.setattr(crossdev, "copy_file_range", unsupported)
+    stats = crossdev.move(src, op.join(tmpdir_b, b"dst"))
+    assert stats.strategies == {"sendfile": 1}
+    monkeypatch.setattr(crossdev, "sendfile", unsupported)
+    stats = crossdev.move(op.join(tmpdir_b, b"dst"), src)
+    assert stats.strategies == {"read": 1}
+    with open(src, "rb") as f:
+        assert f.read() == b"x" * 100
+
+
+def test_move_failure_keeps_source(tmpdir_b, monkeypatch):
+    def failing_copy(src_fd, dst_fd, size):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    src = op.join(tmpdir_b, b"src")
+    dst = op.join(tmpdir_b, b"dst")
+    make_tree(src)
+    monkeypatch.setattr(crossdev, "copy_data", failing_copy)
+    pytest.raises(OSError, crossdev.move, src, dst)
+    assert op.exists(op.join(src, b"sub", b"subsub", b"c"))
+    assert not op.lexists(dst)
+
+
+def test_scan_tree(tmpdir_b):
+    src = op.join(tmpdir_b, b"src")
+    make_tree(src)
+    with ThreadPoolExecutor(2) as executor:
+        scan = crossdev.scan_tree(src, executor)
+    assert sorted(path for path, _ in scan.dirs) == [src, op.join(src, b"sub"), op.join(src, b"sub", b"subsub")]
+    assert len(scan.files) == 3
+    assert [path for path, _ in scan.others] == [op.join(src, b"link")]
+    # With the size of the symlink
+    assert scan.size == 4000 + 8000 + 12000 + 1
+    assert scan.errors == []
+
+
+def test_move_tree_checks_access_first(tmpdir_b, monkeypatch):
+    src = op.join(tmpdir_b, b"src")
+    dst = op.join(tmpdir_b, b"dst")
+    make_tree(src)
+    access = os.access
+    monkeypatch.setattr(os, "access", lambda path, mode, **kwargs: path != op.join(src, b"sub", b"b"))
+    with pytest.raises(PermissionError):
+        crossdev.move(src, dst)
+    monkeypatch.setattr(os, "access", access)
+    assert not op.lexists(dst)
+    assert op.exists(op.join(src, b"sub", b"b"))
+
+
+def test_move_tree_copy_failure_waits_for_copies(tmpdir_b, monkeypatch):
+    src = op.join(tmpdir_b, b"src")
+    dst = op.join(tmpdir_b, b"dst")
+    make_tree(src)
+    copy_file = crossdev.copy_file
+    running = []
+
+    def failing_copy(src_path, dst_path, *args):
+        if op.basename(src_path) == b"a":
+            raise OSError(errno.EIO, "Input/output error")
+        # Still copying when the first one fails
+        running.append(src_path)
+        copy_file(src_path, dst_path, *args)
+        time.sleep(0.2)
+        running.remove(src_path)
+
+    monkeypatch.setattr(crossdev, "copy_file", failing_copy)
+    remove = crossdev.remove
+    removing = []
+
+    def checked_remove(path, workers=None):
+        removing.append(list(running))
+        remove(path, workers)
+
+    monkeypatch.setattr(crossdev, "remove", checked_remove)
+    with pytest.raises(OSError) as excinfo:
+        crossdev.move(src, dst, workers=3)
+    # The partial copy is only removed once no file is being copied in it
+    assert removing == [[]]
+    assert excinfo.value.errno == errno.EIO
+    assert not op.lexists(dst)
+    assert op.exists(op.join(src, b"sub", b"subsub", b"c"))
+
+
+def test_move_tree_resumes(tmpdir_b, monkeypatch):
+    src = op.join(tmpdir_b, b"src")
+    dst = op.join(tmpdir_b, b"dst")
+    partial_dir = op.join(tmpdir_b, b"partial")
+    make_tree(src)
+    copy_file = crossdev.copy_file
+
+    def failing_copy(src_path, dst_path, *args):
+        if op.basename(src_path) == b"c":
+            raise OSError(errno.EIO, "Input/output error")
+        copy_file(src_path, dst_path, *args)
+
+    monkeypatch.setattr(crossdev, "copy_file", failing_copy)
+    pytest.raises(OSError, crossdev.move, src, dst, workers=1, partial_dir=partial_dir)
+    assert not op.lexists(dst)
+    [partial] = os.listdir(partial_dir)
+    with open(op.join(partial_dir, partial, b"stale"), "wb"):
+        pass
+    monkeypatch.setattr(crossdev, "copy_file", copy_file)
+    stats = crossdev.move(src, dst, partial_dir=partial_dir)
+    assert stats.files == 1
+    assert not op.lexists(src)
+    assert os.listdir(partial_dir) == []
+    assert sorted(os.listdir(dst)) == [b"a", b"link", b"sub"]
+    with open(op.join(dst, b"sub", b"subsub", b"c"), "rb") as f:
+        assert f.read() == b"data" * 3000
+
+
+def test_move_tree_remembers_strategy(tmpdir_b, monkeypatch):
+    clones = []
+
+    def clone(src_fd, dst_fd):
+        clones.append(src_fd)
+        return False
+
+    src = op.join(tmpdir_b, b"src")
+    make_tree(src)
+    monkeypatch.setattr(crossdev, "clone", clone)
+    stats = crossdev.move(src, op.join(tmpdir_b, b"dst"), workers=1)
+    assert stats.files == 3
+    assert len(clones) == 1
@@ -0,0 +1,117 @@
+# encoding: utf-8
+import os
+import queue
+import sys
+import threading
+import pytest
+from os import path as op
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+from send2trash import daemon  # noqa: E402
+
+
+@pytest.fixture
+def files(make_home_files):
+    return make_home_files(4, prefix="send2trash_daemon")
+
+
+@pytest.fixture
+def socket_path(tmpdir_b):
+    return op.join(os.fsdecode(tmpdir_b), "daemon.sock")
+
+
+@pytest.fixture
+def server(socket_path):
+    server = daemon.TrashServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_send2trash_many(server, socket_path, files):
+    missing = files[0] + "_missing"
+    result = daemon.send2trash_many(files + [missing], socket_path, fallback=False)
+    assert result.succeeded == files
+    [(path, error)] = result.failed
+    assert path == missing
+    assert isinstance(error, FileNotFoundError)
+    assert not any(op.exists(file) for file in files)
+
+
+def test_concurrent_clients(server, socket_path, files):
+    results = [None] * len(files)
+
+    def trash(index):
+        results[index] = daemon.send2trash_many([files[index]], socket_path, fallback=False)
+
+    threads = [threading.Thread(target=trash, args=(index,)) for index in range(len(files))]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert all(result.ok for result in results)
+    assert not any(op.exists(file) for file in files)
+
+
+def test_fallback_without_daemon(socket_path, files):
+    with pytest.raises(ConnectionRefusedError):
+        daemon.send2trash_many(files, socket_path, fallback=False)
+    assert daemon.send2trash_many(files, socket_path).ok
+    assert not any(op.exists(file) for file in files)
+
+
+def test_stale_socket_replaced(socket_path):
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    sock.close()
+    server = daemon.TrashServer(socket_path)
+    server.server_close()
+    assert not op.exists(socket_path)
+
+
+def test_daemon_of_other_user_ignored(server, socket_path, files, monkeypatch):
+    monkeypatch.setattr(daemon, "peer_uid", lambda sock: os.getuid() + 1)
+    assert daemon.connect(socket_path) is None
+    with pytest.raises(ConnectionRefusedError):
+        daemon.send2trash_many(files, socket_path, fallback=False)
+
+
+def test_default_socket_in_private_dir(socket_path, monkeypatch):
+    monkeypatch.delenv(daemon.SOCKET_ENV, raising=False)
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(daemon.tempfile, "tempdir", op.dirname(socket_path))
+    server = daemon.TrashServer()
+    try:
+        private_dir = op.dirname(server.socket_path)
+        assert private_dir == op.join(op.dirname(socket_path), "send2trash-%d" % os.getuid())
+        assert os.stat(private_dir).st_mode & 0o777 == 0o700
+        sock = daemon.connect()
+        assert sock is not None
+        sock.close()
+        # Opened to others, the directory isn't trusted anymore
+        os.chmod(private_dir, 0o777)
+        assert daemon.connect() is None
+    finally:
+        server.server_close()
+
+
+def test_batcher_never_waits(monkeypatch):
+    class NoWaitQueue(queue.Queue):
+        def get(self, block=True, timeout=None):
+            assert timeout is None
+            return queue.Queue.get(self, block, timeout)
+
+    monkeypatch.setattr(daemon.Batcher, "run", lambda self: None)
+    batcher = daemon.Batcher(max_paths=3)
+    batcher.thread.join()
+    batcher.queue = NoWaitQueue()
+    for paths in (["a"], ["b", "c"], ["d"]):
+        batcher.submit(paths)
+    # What is already waiting joins the batch, up to max_paths
+    assert [paths for paths, _ in batcher.collect()] == [["a"], ["b", "c"]]
+    assert [paths for paths, _ in batcher.collect()] == [["d"]]
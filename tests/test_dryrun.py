@@ -0,0 +1,53 @@
+# encoding: utf-8
+import os
+import sys
+import pytest
+from os import path as op
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+from send2trash import dryrun  # noqa: E402
+from send2trash.plat_other import HOMETRASH, INFO_SUFFIX  # noqa: E402
+
+
+@pytest.fixture
+def files(make_home_files):
+    files = make_home_files(3, prefix="send2trash_plan")
+    for file in files:
+        with open(file, "wb") as f:
+            f.write(b"x" * 100)
+    # A trash entry already taking the name of the first one
+    info = op.join(HOMETRASH, "info", op.basename(files[0]) + INFO_SUFFIX.decode())
+    os.makedirs(op.dirname(info), exist_ok=True)
+    with open(info, "w"):
+        pass
+    yield files
+    os.remove(info)
+
+
+def test_plan(files):
+    missing = files[0] + "_missing"
+    result = dryrun.plan(files + [files[1], missing])
+    [group] = result.groups.values()
+    assert group.dest_trash == os.fsencode(HOMETRASH)
+    assert not group.cross_dev
+    assert group.paths == files + [files[1]]
+    # files[0] is already in the trash, files[1] is given twice
+    assert group.collisions == [files[0], files[1]]
+    assert [path for path, _ in result.errors] == [missing]
+    assert result.renames == 4
+    assert result.copies == result.copy_bytes == 0
+    assert all(op.exists(file) for file in files)
+
+
+def test_plan_cross_dev(files, monkeypatch):
+    monkeypatch.setattr(dryrun, "existing_dev", lambda path: -1)
+    result = dryrun.plan(files)
+    [group] = result.groups.values()
+    assert group.cross_dev
+    assert result.copies == 3
+    assert result.copy_bytes == 300
+    assert result.estimated_seconds == pytest.approx(
+        3 * dryrun.COPY_FILE_SECONDS + 300.0 / dryrun.COPY_BYTES_PER_SECOND
+    )
@@ -0,0 +1,233 @@
+# encoding: utf-8
+import os
+import sys
+import pytest
+from datetime import datetime, timedelta
+from os import path as op
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+from send2trash import manage  # noqa: E402
+from send2trash.plat_other import trash_move  # noqa: E402
+from tests.conftest import touch  # noqa: E402
+
+
+@pytest.fixture
+def volume(tmpdir_b):
+    # A fake volume holding a fallback trash directory and some files
+    return tmpdir_b, op.join(tmpdir_b, b".Trash-" + str(os.getuid()).encode("ascii"))
+
+
+def trash_files(topdir, trash_dir, names):
+    for name in names:
+        path = op.join(topdir, name)
+        if not op.exists(path):
+            touch(path)
+        trash_move(path, trash_dir, topdir)
+
+
+def test_parse_trashinfo():
+    data = b"[Trash Info]\nPath=/a%20b\nDeletionDate=2024-01-02T03:04:05\n"
+    assert manage.parse_trashinfo(data) == (b"/a%20b", b"2024-01-02T03:04:05")
+    assert manage.parse_trashinfo(b"[Other]\nPath=/a\n") == (None, None)
+
+
+def test_default_topdir():
+    assert manage.default_topdir(b"/mnt/.Trash/1000") == b"/mnt"
+    assert manage.default_topdir(b"/mnt/.Trash-1000") == b"/mnt"
+    assert manage.default_topdir(b"/home/u/.local/share/Trash") == b"/home/u/.local/share"
+
+
+def test_list_trash(volume):
+    topdir, trash_dir = volume
+    trash_files(topdir, trash_dir, [b"a file", b"a file", b"b"])
+    entries = sorted(manage.list_trash(trash_dir), key=lambda entry: entry.name)
+    assert [entry.name for entry in entries] == [b"a file", b"a file 1", b"b"]
+    assert [entry.path for entry in entries] == [op.join(topdir, b"a file")] * 2 + [op.join(topdir, b"b")]
+    assert all(isinstance(entry.deletion_date, datetime) for entry in entries)
+    assert all(op.exists(entry.files_path) for entry in entries)
+    assert not hasattr(entries[0], "__dict__")
+
+
+def test_list_trash_invalid_info(volume):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(trash_dir, b"info"))
+    with open(op.join(trash_dir, b"info", b"x.trashinfo"), "wb") as f:
+        f.write(b"[Trash Info]\nDeletionDate=garbage\n")
+    [entry] = manage.list_trash(trash_dir)
+    assert entry.path is None
+    assert entry.deletion_date is None
+
+
+def test_list_trash_dotdot_path(volume):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(trash_dir, b"info"))
+    with open(op.join(trash_dir, b"info", b"x.trashinfo"), "wb") as f:
+        f.write(b"[Trash Info]\nPath=sub/../../etc/x\nDeletionDate=2024-01-02T03:04:05\n")
+    [entry] = manage.list_trash(trash_dir)
+    assert entry.path is None
+    result = manage.restore([entry])
+    assert [entry.name for entry, error in result.failed] == [b"x"]
+
+
+def test_trash_dirs_includes_volumes(volume, monkeypatch):
+    topdir, trash_dir = volume
+    trash_files(topdir, trash_dir, [b"a"])
+    monkeypatch.setattr(manage.plat_other.mount_table, "get_mount_points", lambda: {b"/", topdir})
+    assert (trash_dir, topdir) in list(manage.trash_dirs())
+
+
+def test_restore(volume):
+    topdir, trash_dir = volume
+    os.mkdir(op.join(topdir, b"sub"))
+    trash_files(topdir, trash_dir, [b"a", b"sub/b", b"sub/b", b"c"])
+    os.rmdir(op.join(topdir, b"sub"))
+    touch(op.join(topdir, b"c"))
+    entries = sorted(manage.list_trash(trash_dir), key=lambda entry: entry.name)
+    result = manage.restore(entries)
+    assert [entry.name for entry in result.succeeded] == [b"a", b"b"]
+    assert [(entry.name, type(error)) for entry, error in result.failed] == [
+        (b"b 1", FileExistsError),
+        (b"c", FileExistsError),
+    ]
+    assert op.exists(op.join(topdir, b"a"))
+    assert op.exists(op.join(topdir, b"sub", b"b"))
+    # restored entries are gone from the trash, conflicting ones are kept
+    assert sorted(entry.name for entry in manage.list_trash(trash_dir)) == [b"b 1", b"c"]
+    assert sorted(os.listdir(op.join(trash_dir, b"files"))) == [b"b 1", b"c"]
+
+
+@pytest.mark.parametrize("renameat2", [True, False])
+def test_restore_never_replaces(volume, monkeypatch, renameat2):
+    topdir, trash_dir = volume
+    os.mkdir(op.join(topdir, b"dir"))
+    trash_files(topdir, trash_dir, [b"a", b"dir"])
+    if not renameat2:
+        monkeypatch.setattr("send2trash.util.renameat2_noreplace", lambda src, dst: False)
+    # Created since they were trashed
+    with open(op.join(topdir, b"a"), "wb") as f:
+        f.write(b"new")
+    os.mkdir(op.join(topdir, b"dir"))
+    touch(op.join(topdir, b"dir", b"new"))
+    result = manage.restore(list(manage.list_trash(trash_dir)))
+    monkeypatch.undo()
+    assert [type(error) for _, error in result.failed] == [FileExistsError, FileExistsError]
+    assert all(error.filename == entry.path for entry, error in result.failed)
+    with open(op.join(topdir, b"a"), "rb") as f:
+        assert f.read() == b"new"
+    assert os.listdir(op.join(topdir, b"dir")) == [b"new"]
+    assert sorted(os.listdir(op.join(trash_dir, b"files"))) == [b"a", b"dir"]
+
+
+def test_restore_cross_dev(volume):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(topdir, b"tree", b"sub"))
+    touch(op.join(topdir, b"tree", b"sub", b"f"))
+    trash_files(topdir, trash_dir, [b"tree", b"a"])
+    for entry in manage.list_trash(trash_dir):
+        manage.restore_entry(entry, cross_dev=True)
+    assert op.exists(op.join(topdir, b"tree", b"sub", b"f"))
+    assert op.exists(op.join(topdir, b"a"))
+    assert sorted(os.listdir(topdir)) == [b".Trash-" + str(os.getuid()).encode("ascii"), b"a", b"tree"]
+    assert list(manage.list_trash(trash_dir)) == []
+
+
+def set_deletion_date(entry, date):
+    path = os.fsdecode(entry.path)
+    with open(entry.info_path, "w") as f:
+        f.write("[Trash Info]\nPath=%s\nDeletionDate=%s\n" % (path, date))
+
+
+def test_purge_older_than(volume):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(topdir, b"tree", b"sub", b"subsub"))
+    touch(op.join(topdir, b"tree", b"sub", b"f"))
+    touch(op.join(topdir, b"tree", b"sub", b"subsub", b"g"))
+    trash_files(topdir, trash_dir, [b"tree", b"old", b"new"])
+    for entry in manage.list_trash(trash_dir):
+        if entry.name != b"new":
+            set_deletion_date(entry, "2020-01-01T00:00:00")
+    result = manage.purge(older_than=timedelta(days=30), trash_dir=trash_dir)
+    assert result.ok
+    assert sorted(entry.name for entry in result.succeeded) == [b"old", b"tree"]
+    assert [entry.name for entry in manage.list_trash(trash_dir)] == [b"new"]
+    assert os.listdir(op.join(trash_dir, b"files")) == [b"new"]
+
+
+def test_purge_max_bytes(volume):
+    topdir, trash_dir = volume
+    for index, name in enumerate([b"a", b"b", b"c"]):
+        with open(op.join(topdir, name), "wb") as f:
+            f.write(b"x" * 100)
+        trash_files(topdir, trash_dir, [name])
+    for entry in manage.list_trash(trash_dir):
+        set_deletion_date(entry, "2020-01-0%dT00:00:00" % (b"abc".index(entry.name) + 1))
+    result = manage.purge(max_bytes=150, trash_dir=trash_dir)
+    assert sorted(entry.name for entry in result.succeeded) == [b"a", b"b"]
+    assert [entry.name for entry in manage.list_trash(trash_dir)] == [b"c"]
+
+
+def test_purge_max_bytes_cached_sizes(volume, monkeypatch):
+    topdir, trash_dir = volume
+    for name in [b"a", b"b"]:
+        os.mkdir(op.join(topdir, name))
+        with open(op.join(topdir, name, b"f"), "wb") as f:
+            f.write(b"x" * 100)
+        trash_files(topdir, trash_dir, [name])
+    for entry in manage.list_trash(trash_dir):
+        set_deletion_date(entry, "2020-01-0%dT00:00:00" % (b"ab".index(entry.name) + 1))
+    # Caches the sizes of both directories
+    assert manage.trash_size(trash_dir) == 200
+    monkeypatch.setattr(manage, "tree_size", None)
+    result = manage.purge(max_bytes=150, trash_dir=trash_dir)
+    assert [entry.name for entry in result.succeeded] == [b"a"]
+    assert [entry.name for entry in manage.list_trash(trash_dir)] == [b"b"]
+
+
+def test_purge_all(volume):
+    topdir, trash_dir = volume
+    trash_files(topdir, trash_dir, [b"a", b"b"])
+    assert len(manage.purge(trash_dir=trash_dir, workers=2)) == 2
+    assert list(manage.list_trash(trash_dir)) == []
+    assert os.listdir(op.join(trash_dir, b"files")) == []
+
+
+def test_trash_size(volume, monkeypatch):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(topdir, b"tree", b"sub"))
+    with open(op.join(topdir, b"tree", b"sub", b"f"), "wb") as f:
+        f.write(b"x" * 1000)
+    with open(op.join(topdir, b"file"), "wb") as f:
+        f.write(b"x" * 10)
+    location = manage.plat_other.TrashLocation(trash_dir, topdir, 0)
+    with manage.plat_other.TrashBatch() as batch:
+        batch.move(op.join(topdir, b"tree"), location, is_dir=True)
+        batch.move(op.join(topdir, b"file"), location)
+    # A rename doesn't give the size of the tree for free
+    assert manage.plat_other.read_directorysizes(trash_dir) == {}
+    expected = manage.tree_size(op.join(trash_dir, b"files", b"tree")) + 10
+    assert manage.trash_size(trash_dir) == expected
+    sizes = manage.plat_other.read_directorysizes(trash_dir)
+    assert list(sizes) == [b"tree"]
+    # Cached directories are not walked again
+    monkeypatch.setattr(manage, "tree_size", None)
+    assert manage.trash_size(trash_dir) == expected
+    monkeypatch.undo()
+    manage.purge(trash_dir=trash_dir)
+    assert manage.plat_other.read_directorysizes(trash_dir) == {}
+
+
+def test_trash_size_of_copied_tree(volume, monkeypatch):
+    topdir, trash_dir = volume
+    os.makedirs(op.join(topdir, b"tree", b"sub"))
+    with open(op.join(topdir, b"tree", b"sub", b"f"), "wb") as f:
+        f.write(b"x" * 1000)
+    location = manage.plat_other.TrashLocation(trash_dir, topdir, 0)
+    with manage.plat_other.TrashBatch() as batch:
+        batch.move(op.join(topdir, b"tree"), location, cross_dev=True, is_dir=True)
+    # Known from the scan of the copy
+    sizes = manage.plat_other.read_directorysizes(trash_dir)
+    assert sizes[b"tree"][0] == 1000
+    monkeypatch.setattr(manage, "tree_size", None)
+    assert manage.trash_size(trash_dir) == 1000
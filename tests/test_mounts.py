@@ -0,0 +1,47 @@
+# encoding: utf-8
+import os
+import sys
+import pytest
+
+from send2trash.mounts import MountTable, parse_mountinfo
+
+MOUNTINFO = b"""23 28 0:22 / /proc rw,relatime - proc proc rw
+28 1 254:0 / / rw,relatime - ext4 /dev/vda rw
+40 28 254:0 /srv/data /mnt/my\\040data rw,relatime - ext4 /dev/vda rw
+"""
+
+
+@pytest.fixture
+def mountinfo(tmpdir_b):
+    path = os.path.join(tmpdir_b, b"mountinfo")
+    with open(path, "wb") as f:
+        f.write(MOUNTINFO)
+    return path
+
+
+def test_parse_mountinfo():
+    assert parse_mountinfo(MOUNTINFO) == {b"/proc", b"/", b"/mnt/my data"}
+
+
+def test_find_mount_point(mountinfo):
+    table = MountTable(mountinfo)
+    # bind mounts are found even though ismount() can miss them
+    assert table.find_mount_point(b"/mnt/my data/some/file") == b"/mnt/my data"
+    assert table.find_mount_point("/mnt/my data") == "/mnt/my data"
+    assert table.find_mount_point(b"/mnt/my") == b"/"
+    assert table.find_mount_point(b"/proc/self") == b"/proc"
+    table.close()
+
+
+def test_unavailable():
+    table = MountTable(b"/nonexistent/mountinfo")
+    assert table.get_mount_points() is None
+    assert table.find_mount_point(b"/tmp") is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Requires /proc/self/mountinfo")
+def test_proc_mountinfo():
+    table = MountTable()
+    assert b"/" in table.get_mount_points()
+    assert table.find_mount_point(b"/") == b"/"
+    table.close()
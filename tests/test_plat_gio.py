@@ -0,0 +1,35 @@
+# encoding: utf-8
+import sys
+import pytest
+from os import path as op
+
+if sys.platform in ("win32", "darwin"):
+    pytest.skip("Skipping non-freedesktop tests", allow_module_level=True)
+
+pytest.importorskip("gi")
+plat_gio = pytest.importorskip("send2trash.plat_gio")
+
+
+@pytest.fixture
+def files(make_home_files):
+    return make_home_files(40, prefix="send2trash_gio")
+
+
+def test_send2trash_many(files):
+    missing = files[0] + "_missing"
+    result = plat_gio.send2trash_many(files + [missing], max_in_flight=4)
+    assert result.succeeded == files
+    [(path, error)] = result.failed
+    assert path == missing
+    assert isinstance(error, OSError)
+    assert not any(op.exists(file) for file in files)
+
+
+def test_send2trash_many_cancelled(files):
+    from gi.repository import Gio
+
+    cancellable = Gio.Cancellable()
+    cancellable.cancel()
+    result = plat_gio.send2trash_many(files, cancellable=cancellable)
+    assert len(result.failed) == len(files)
+    assert all(op.exists(file) for file in files)
@@ -0,0 +1,114 @@
+# encoding: utf-8
+# plat_gio against a fake gi.repository, so that it is tested without PyGObject
+import importlib.util
+import sys
+import types
+from collections import deque
+
+import pytest
+
+
+class GError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+class FakeGio:
+    """The parts of GLib, GObject and Gio that plat_gio uses.
+
+    Requests complete in submission order, one per main context iteration,
+    and a request already in flight completes even if cancelled, as GIO
+    doesn't guarantee more. Paths starting with "missing" fail.
+    """
+
+    PRIORITY_DEFAULT = 0
+    NOT_FOUND, NOT_SUPPORTED, CANCELLED = range(3)
+
+    def __init__(self):
+        self.pending = deque()
+        self.trashed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        fake = self
+
+        class Cancellable:
+            def __init__(self):
+                self.cancelled = False
+
+            def cancel(self):
+                self.cancelled = True
+
+            def is_cancelled(self):
+                return self.cancelled
+
+        class File:
+            def __init__(self, path):
+                self.path = path
+
+            @staticmethod
+            def new_for_path(path):
+                return File(path)
+
+            def trash_async(self, priority, cancellable, callback, data):
+                fake.in_flight += 1
+                fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                fake.pending.append((callback, self, data))
+
+            def trash_finish(self, result):
+                fake.in_flight -= 1
+                if self.path.startswith("missing"):
+                    raise GError(fake.NOT_FOUND, "No such file")
+                fake.trashed.append(self.path)
+
+        class MainContext:
+            def push_thread_default(self):
+                pass
+
+            def pop_thread_default(self):
+                pass
+
+            def iteration(self, may_block):
+                callback, f, data = fake.pending.popleft()
+                callback(f, None, data)
+
+        self.Cancellable = Cancellable
+        self.File = File
+        self.MainContext = MainContext
+        self.IOErrorEnum = types.SimpleNamespace(NOT_SUPPORTED=self.NOT_SUPPORTED, CANCELLED=self.CANCELLED)
+        self.GError = GError
+
+
+@pytest.fixture
+def gio(monkeypatch):
+    fake = FakeGio()
+    repository = types.ModuleType("gi.repository")
+    repository.GLib = repository.GObject = repository.Gio = fake
+    gi = types.ModuleType("gi")
+    gi.repository = repository
+    monkeypatch.setitem(sys.modules, "gi", gi)
+    monkeypatch.setitem(sys.modules, "gi.repository", repository)
+    # A copy of the module of its own, the real one may be imported elsewhere
+    spec = importlib.util.find_spec("send2trash.plat_gio")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, fake
+
+
+def test_send2trash_stops_at_first_error(gio):
+    plat_gio, fake = gio
+    with pytest.raises(OSError):
+        plat_gio.send2trash(["a", "missing", "b", "c"])
+    assert fake.trashed == ["a"]
+    assert fake.max_in_flight == 1
+
+
+def test_send2trash_many_concurrent(gio):
+    plat_gio, fake = gio
+    paths = ["path%d" % index for index in range(10)]
+    result = plat_gio.send2trash_many(paths[:5] + ["missing"] + paths[5:], max_in_flight=4)
+    assert result.succeeded == paths
+    [(path, error)] = result.failed
+    assert path == "missing" and isinstance(error, OSError)
+    assert fake.max_in_flight == 4
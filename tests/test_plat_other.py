@@ -1,10 +1,11 @@
 # encoding: utf-8
 import pytest
 import codecs
+import errno
 import os
 import sys
 from os import path as op
-from send2trash import TrashPermissionError
+from send2trash import SourceRemovalError, TrashPermissionError
 
 try:
     from configparser import ConfigParser
@@ -15,6 +16,7 @@ except ImportError:
 from tempfile import mkdtemp, NamedTemporaryFile
 import shutil
 import stat
+import subprocess
 import uuid
 
 if sys.platform != "win32":
@@ -23,6 +25,7 @@ if sys.platform != "win32":
 
     INFO_SUFFIX = send2trash.plat_other.INFO_SUFFIX.decode()
     HOMETRASH = send2trash.plat_other.HOMETRASH
+    from tests.conftest import touch
 else:
     pytest.skip("Skipping non-windows tests", allow_module_level=True)
 
@@ -75,11 +78,6 @@ def test_multitrash(testfiles):
     assert any([op.exists(filename) for filename in filenames]) is False
 
 
-def touch(path):
-    with open(path, "a"):
-        os.utime(path, None)
-
-
 def _filesys_enc():
     enc = sys.getfilesystemencoding()
     # Get canonical name of codec
@@ -134,13 +132,36 @@ class ExtVol:
                 return True
             return old_ismount(path)
 
+        def s_find_mount_point(path):
+            from send2trash.plat_other import is_parent
+
+            if is_parent(self.trash_topdir, path):
+                return self.trash_topdir if isinstance(path, str) else self.trash_topdir_b
+            return old_find_mount_point(path)
+
+        def s_statdev(path, st):
+            from send2trash.plat_other import is_parent
+
+            if is_parent(self.trash_topdir, path):
+                return "dev"
+            return st.st_dev
+
         self.old_ismount = old_ismount = op.ismount
         self.old_getdev = send2trash.plat_other.get_dev
+        self.old_statdev = send2trash.plat_other.stat_dev
+        self.mount_table = send2trash.plat_other.mount_table
+        old_find_mount_point = self.mount_table.find_mount_point
         send2trash.plat_other.os.path.ismount = s_ismount
         send2trash.plat_other.get_dev = s_getdev
+        send2trash.plat_other.stat_dev = s_statdev
+        self.mount_table.find_mount_point = s_find_mount_point
+        send2trash.plat_other.clear_cache()
 
     def cleanup(self):
+        del self.mount_table.find_mount_point
+        send2trash.plat_other.clear_cache()
         send2trash.plat_other.get_dev = self.old_getdev
+        send2trash.plat_other.stat_dev = self.old_statdev
         send2trash.plat_other.os.path.ismount = self.old_ismount
         shutil.rmtree(self.trash_topdir)
 
@@ -230,3 +251,413 @@ def test_trash_symlink(gen_ext_vol):
         is True
     )
     os.remove(sl_dir)
+
+
+def test_multitrash_resolves_trash_once(testfiles, monkeypatch):
+    calls = []
+    old_getdev = send2trash.plat_other.get_dev
+    old_statdev = send2trash.plat_other.stat_dev
+
+    def s_getdev(path):
+        calls.append(path)
+        return old_getdev(path)
+
+    def s_statdev(path, st):
+        calls.append(path)
+        return old_statdev(path, st)
+
+    monkeypatch.setattr(send2trash.plat_other, "get_dev", s_getdev)
+    monkeypatch.setattr(send2trash.plat_other, "stat_dev", s_statdev)
+    send2trash.plat_other.clear_cache()
+    s2t([file.name for file in testfiles])
+    # one lookup per file plus a single one for the home directory
+    assert len(calls) == len(testfiles) + 1
+
+
+def test_plan(testfile):
+    missing = testfile.name + "_missing"
+    batch = send2trash.plat_other.TrashBatch()
+    plan = batch.plan([testfile.name, missing, 42])
+    assert len(plan) == 3
+    [item] = plan.valid
+    assert item.path == testfile.name
+    assert item.real_path == os.fsencode(op.realpath(testfile.name))
+    assert item.location.dest_trash == send2trash.plat_other.HOMETRASH_B
+    [(path, error), (path2, error2)] = plan.errors
+    assert path == missing and isinstance(error, OSError)
+    assert path2 == 42 and isinstance(error2, TypeError)
+    # A failing path stops send2trash before the paths after it
+    pytest.raises(OSError, s2t, [missing, testfile.name])
+    assert op.exists(testfile.name)
+    batch.execute(item)
+    assert not op.exists(testfile.name)
+
+
+def test_plan_tree_checks_contents(tmpdir_b, monkeypatch):
+    src = op.join(tmpdir_b, b"src")
+    os.makedirs(op.join(src, b"sub"))
+    touch(op.join(src, b"sub", b"locked"))
+    access = os.access
+    monkeypatch.setattr(os, "access", lambda path, mode, **kwargs: not path.endswith(b"locked"))
+    # Renamed as a whole, what's in it doesn't matter
+    [item] = send2trash.plat_other.TrashBatch(cache=send2trash.plat_other.TrashCache(), tree=True).plan([src])
+    assert item.error is None and item.scan is None
+    # To be copied to another device
+    monkeypatch.setattr(send2trash.plat_other, "existing_dev", lambda path: -1)
+    [item] = send2trash.plat_other.TrashBatch(cache=send2trash.plat_other.TrashCache(), tree=True).plan([src])
+    monkeypatch.setattr(os, "access", access)
+    assert isinstance(item.error, PermissionError)
+    assert item.error.filename == op.join(src, b"sub", b"locked")
+
+
+def test_tree_scan_reused_by_copy(tmpdir_b, monkeypatch):
+    from send2trash import crossdev
+
+    src = op.join(tmpdir_b, b"src")
+    os.makedirs(op.join(src, b"sub"))
+    touch(op.join(src, b"sub", b"file"))
+    scans = []
+    scan_tree = crossdev.scan_tree
+    monkeypatch.setattr(crossdev, "scan_tree", lambda *args: scans.append(args) or scan_tree(*args))
+    monkeypatch.setattr(send2trash.plat_other, "existing_dev", lambda path: -1)
+    batch = send2trash.plat_other.TrashBatch(cache=send2trash.plat_other.TrashCache(), tree=True)
+    [item] = batch.plan([src])
+    location = send2trash.plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    batch.move_item(item, location, cross_dev=True)
+    assert len(scans) == 1
+    assert not op.exists(src)
+    assert op.exists(op.join(tmpdir_b, b"trash", b"files", b"src", b"sub", b"file"))
+
+
+def test_trash_move_resumes_cross_dev(tmpdir_b):
+    src = op.join(tmpdir_b, b"src")
+    os.makedirs(op.join(src, b"sub"))
+    touch(op.join(src, b"sub", b"file"))
+    destname = send2trash.plat_other.trash_move(src, tmpdir_b, cross_dev=True, resume=True)
+    assert not op.exists(src)
+    assert op.exists(op.join(tmpdir_b, b"files", destname, b"sub", b"file"))
+    assert os.listdir(op.join(tmpdir_b, send2trash.plat_other.PARTIAL_DIR)) == []
+
+
+def test_trash_move_collisions(tmpdir_b):
+    src_dir = op.join(tmpdir_b, b"src")
+    os.mkdir(src_dir)
+    for _ in range(3):
+        touch(op.join(src_dir, b"core.dump"))
+        send2trash.plat_other.trash_move(op.join(src_dir, b"core.dump"), tmpdir_b)
+    assert sorted(os.listdir(op.join(tmpdir_b, b"files"))) == [b"core 1.dump", b"core 2.dump", b"core.dump"]
+    assert sorted(os.listdir(op.join(tmpdir_b, b"info"))) == [
+        b"core 1.dump.trashinfo",
+        b"core 2.dump.trashinfo",
+        b"core.dump.trashinfo",
+    ]
+
+
+def test_name_allocator_indexes_existing_entries(tmpdir_b):
+    filespath = op.join(tmpdir_b, b"files")
+    infopath = op.join(tmpdir_b, b"info")
+    os.mkdir(filespath)
+    os.mkdir(infopath)
+    touch(op.join(infopath, b"report.csv.trashinfo"))
+    touch(op.join(infopath, b"report 41.csv.trashinfo"))
+    # an entry in files/ without its info file must not be reused either
+    touch(op.join(filespath, b"report 42.csv"))
+    allocator = send2trash.plat_other.NameAllocator()
+    destname, fd = allocator.reserve(filespath, infopath, b"report.csv")
+    os.close(fd)
+    assert destname == b"report 43.csv"
+    assert op.exists(op.join(infopath, b"report 43.csv.trashinfo"))
+    destname, fd = allocator.reserve(filespath, infopath, b"other.csv")
+    os.close(fd)
+    assert destname == b"other.csv"
+
+
+def test_send2trash_many(testfiles):
+    missing = op.join(op.expanduser("~"), "send2trash_test_missing_" + str(uuid.uuid4()))
+    filenames = [file.name for file in testfiles]
+    result = send2trash.plat_other.send2trash_many(filenames[:5] + [missing] + filenames[5:], workers=4)
+    assert not result.ok
+    assert result.succeeded == filenames
+    [(path, error)] = result.failed
+    assert path == missing
+    assert isinstance(error, OSError)
+    assert not any(op.exists(filename) for filename in filenames)
+
+
+def test_send2trash_stops_at_first_error(testfiles, monkeypatch):
+    monkeypatch.setattr(send2trash.plat_other, "PLAN_CHUNK_SIZE", 4)
+    filenames = [file.name for file in testfiles]
+    # In the second chunk, not at its start
+    paths = filenames[:6] + [filenames[0] + "_missing"] + filenames[6:]
+    pytest.raises(OSError, s2t, paths)
+    assert not any(op.exists(filename) for filename in filenames[:6])
+    assert all(op.exists(filename) for filename in filenames[6:])
+    s2t(filenames[6:])
+
+
+def test_trash_broken_symlink(gen_ext_vol):
+    link = op.join(gen_ext_vol[0].trash_topdir, "link")
+    os.symlink(op.join(gen_ext_vol[0].trash_topdir, "missing"), link)
+    s2t(link)
+    assert not op.lexists(link)
+    assert op.lexists(op.join(gen_ext_vol[0].trash_topdir, ".Trash-" + str(os.getuid()), "files", "link"))
+
+
+def test_iter_send2trash_reads_input_lazily(testfiles, monkeypatch):
+    monkeypatch.setattr(send2trash.plat_other, "PLAN_CHUNK_SIZE", 3)
+    filenames = [file.name for file in testfiles]
+    read = []
+
+    def paths():
+        for filename in filenames:
+            read.append(filename)
+            yield filename
+
+    results = send2trash.plat_other.iter_send2trash(paths(), workers=2)
+    assert read == []
+    assert next(results) == (filenames[0], None)
+    assert read == filenames[:3]
+    assert list(results) == [(filename, None) for filename in filenames[1:]]
+    assert not any(op.exists(filename) for filename in filenames)
+
+
+def test_journal(tmpdir_b):
+    src = op.join(tmpdir_b, b"src")
+    touch(src)
+    journal = send2trash.plat_other.Journal(tmpdir_b)
+    destname = send2trash.plat_other.trash_move(src, tmpdir_b, journal=journal)
+    with open(journal.path, "rb") as f:
+        assert f.read() == b"B " + destname + b" " + src + b"\nC " + destname + b"\n"
+    # Held by this process
+    assert send2trash.plat_other.recover_journals(tmpdir_b).trashed == []
+    journal.close()
+    assert os.listdir(op.join(tmpdir_b, send2trash.plat_other.JOURNAL_DIR)) == []
+
+
+def test_trash_move_failure_removes_info(tmpdir_b):
+    journal = send2trash.plat_other.Journal(tmpdir_b)
+    missing = op.join(tmpdir_b, b"missing")
+    pytest.raises(OSError, send2trash.plat_other.trash_move, missing, tmpdir_b, journal=journal)
+    assert os.listdir(op.join(tmpdir_b, b"info")) == []
+    journal.close()
+    assert not op.exists(journal.path)
+
+
+def test_trash_move_source_removal_failure(tmpdir_b, monkeypatch):
+    from send2trash import crossdev
+
+    journal = send2trash.plat_other.Journal(tmpdir_b)
+    src = op.join(tmpdir_b, b"src")
+    touch(src)
+    remove = crossdev.remove
+
+    def failing_remove(path, workers=None):
+        if path == src:
+            raise PermissionError(errno.EACCES, "Permission denied", path)
+        remove(path, workers)
+
+    monkeypatch.setattr(crossdev, "remove", failing_remove)
+    with pytest.raises(SourceRemovalError) as excinfo:
+        send2trash.plat_other.trash_move(src, op.join(tmpdir_b, b"trash"), tmpdir_b, cross_dev=True, journal=journal)
+    assert excinfo.value.filename == src
+    # Copied in full, the entry is kept and committed
+    assert os.listdir(op.join(tmpdir_b, b"trash", b"files")) == [b"src"]
+    assert os.listdir(op.join(tmpdir_b, b"trash", b"info")) == [b"src" + INFO_SUFFIX.encode()]
+    journal.close()
+    assert not op.exists(journal.path)
+
+
+def test_recover_journals(tmpdir_b):
+    send2trash.plat_other.prepare_trash(tmpdir_b)
+    for name in [b"done", b"moved", b"unmoved"]:
+        touch(op.join(tmpdir_b, b"info", name + INFO_SUFFIX.encode()))
+    touch(op.join(tmpdir_b, b"files", b"done"))
+    touch(op.join(tmpdir_b, b"files", b"moved"))
+    # Its .trashinfo lost in the crash
+    touch(op.join(tmpdir_b, b"files", b"lost"))
+    os.mkdir(op.join(tmpdir_b, send2trash.plat_other.JOURNAL_DIR))
+    # Left by a process that died while trashing /src/moved, /src/lost and /src/unmoved
+    with open(op.join(tmpdir_b, send2trash.plat_other.JOURNAL_DIR, b"dead"), "wb") as f:
+        f.write(b"B done /src/done\nB moved /src/moved\nB lost /src/lost\nC done\nB unmoved /src/un%20moved\nC unm")
+    recovery = send2trash.plat_other.recover_journals(tmpdir_b)
+    assert recovery.trashed == [b"/src/done", b"/src/moved", b"/src/lost"]
+    assert recovery.rolled_forward == [b"/src/moved", b"/src/lost"]
+    assert recovery.rolled_back == [b"/src/un moved"]
+    assert sorted(os.listdir(op.join(tmpdir_b, b"info"))) == [
+        name + INFO_SUFFIX.encode() for name in (b"done", b"lost", b"moved")
+    ]
+    for name in (b"moved", b"lost"):
+        with open(op.join(tmpdir_b, b"info", name + INFO_SUFFIX.encode())) as f:
+            assert "Path=/src/" + name.decode() in f.read()
+    assert os.listdir(op.join(tmpdir_b, send2trash.plat_other.JOURNAL_DIR)) == []
+
+
+def test_journal_batch_resumes(tmpdir_b, monkeypatch):
+    from send2trash import manage
+
+    src_dir = op.join(tmpdir_b, b"src")
+    os.mkdir(src_dir)
+    paths = [op.join(src_dir, name) for name in (b"a", b"b")]
+    [touch(path) for path in paths]
+    journal = send2trash.plat_other.Journal(tmpdir_b)
+    send2trash.plat_other.trash_move(paths[0], tmpdir_b, journal=journal)
+    # As if the process died with the journal open
+    os.close(journal.fd)
+    monkeypatch.setattr(manage, "trash_dirs", lambda: [(tmpdir_b, tmpdir_b)])
+    batch = send2trash.plat_other.TrashBatch(journal=True)
+    plan = batch.plan(paths + [op.join(src_dir, b"c")])
+    assert plan.items[0].trashed and plan.items[0].error is None
+    assert not plan.items[1].trashed and plan.items[1].error is None
+    assert isinstance(plan.items[2].error, OSError)
+    assert batch.recovered == {paths[0]}
+
+
+def test_trash_cache_revalidates(gen_ext_vol):
+    trash_dir = op.join(gen_ext_vol[0].trash_topdir, ".Trash")
+    os.mkdir(trash_dir, 0o777 | stat.S_ISVTX)
+    s2t(gen_ext_vol[2])
+    assert op.exists(op.join(trash_dir, str(os.getuid()), "files", gen_ext_vol[1]))
+    # .Trash turned into a symlink: the cached location must not be used anymore
+    shutil.rmtree(trash_dir)
+    os.symlink(gen_ext_vol[0].trash_topdir, trash_dir)
+    touch(gen_ext_vol[2])
+    s2t(gen_ext_vol[2])
+    assert not op.exists(gen_ext_vol[2])
+    assert op.exists(op.join(gen_ext_vol[0].trash_topdir, ".Trash-" + str(os.getuid()), "files", gen_ext_vol[1]))
+    os.remove(trash_dir)
+
+
+@pytest.fixture
+def bind_mount():
+    root = mkdtemp(prefix="s2t_bind")
+    first, second = op.join(root, "first"), op.join(root, "second")
+    os.mkdir(first)
+    os.mkdir(second)
+    mounted = []
+    try:
+        for args in (["-t", "tmpfs", "tmpfs", first], ["--bind", first, second]):
+            if subprocess.run(["mount"] + args, capture_output=True).returncode:
+                pytest.skip("Can't mount filesystems")
+            mounted.insert(0, args[-1])
+        yield first, second
+    finally:
+        # Drops the cached directory descriptors on the mounts
+        send2trash.plat_other.clear_cache()
+        for mount_point in mounted:
+            subprocess.run(["umount", mount_point], check=True)
+        shutil.rmtree(root)
+
+
+def test_trash_cache_per_mount(bind_mount):
+    first, second = bind_mount
+    name = "send2trash_test_" + str(uuid.uuid4())
+    touch(op.join(first, "first.txt"))
+    touch(op.join(second, name))
+    s2t(op.join(first, "first.txt"))
+    # Same device, but the trash of the first mount can't be renamed into
+    s2t(op.join(second, name))
+    trash_dir = ".Trash-" + str(os.getuid())
+    assert op.exists(op.join(second, trash_dir, "files", name))
+    assert not op.exists(op.join(HOMETRASH, "files", name))
+
+
+def test_plan_groups_per_mount(bind_mount):
+    first, second = bind_mount
+    paths = [op.join(mount_point, name) for mount_point in bind_mount for name in ("a", "b")]
+    [touch(path) for path in paths]
+    plan = send2trash.plat_other.TrashBatch().plan(paths)
+    locations = [item.location for item in plan]
+    assert locations[0] is locations[1]
+    assert locations[2] is locations[3]
+    assert locations[0].topdir == os.fsencode(first)
+    assert locations[2].topdir == os.fsencode(second)
+
+
+def test_trash_cache_ttl(monkeypatch):
+    calls = []
+    monkeypatch.setattr(send2trash.plat_other, "find_trash", lambda *args: calls.append(args) or (b"t", b"/"))
+    cache = send2trash.plat_other.TrashCache(ttl=0)
+    cache.lookup(b"/some/path", 1)
+    cache.lookup(b"/some/path", 1)
+    assert len(calls) == 2
+    cache = send2trash.plat_other.TrashCache(ttl=3600)
+    cache.lookup(b"/some/path", 1)
+    location = cache.lookup(b"/some/path", 1)
+    assert len(calls) == 3
+    assert cache.invalidate(location)
+    cache.lookup(b"/some/path", 1)
+    assert len(calls) == 4
+
+
+def test_durable_batch(tmpdir_b, monkeypatch):
+    from send2trash import crossdev
+
+    src_dir = op.join(tmpdir_b, b"src")
+    os.mkdir(src_dir)
+    copied = op.join(src_dir, b"copied")
+    syncs = []
+    monkeypatch.setattr(send2trash.plat_other, "sync_filesystem", lambda path: syncs.append(path))
+    monkeypatch.setattr(crossdev, "sync_filesystem", lambda path: syncs.append(op.exists(copied)))
+    location = send2trash.plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    with send2trash.plat_other.TrashBatch(durable=True, sync_every=3) as batch:
+        for index in range(5):
+            path = op.join(src_dir, str(index).encode("ascii"))
+            touch(path)
+            batch.move(path, location)
+        touch(copied)
+        batch.move(copied, location, cross_dev=True)
+    stats = batch.durability
+    assert stats.items == 6
+    assert stats.syncs == 2
+    # A copy is synced while its source is still there, then one sync of the
+    # trash filesystem per sync point
+    assert syncs == [location.dest_trash, True, location.dest_trash]
+    assert stats.fsyncs == 2
+
+
+@pytest.mark.skipif(not send2trash.plat_other.USE_DIR_FD, reason="Requires dir_fd support")
+def test_trash_move_dir_fds(tmpdir_b):
+    src_dir = op.join(tmpdir_b, b"src")
+    os.mkdir(src_dir)
+    location = send2trash.plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    location.prepare()
+    assert location.dir_fds is not None
+    batch = send2trash.plat_other.TrashBatch()
+    for _ in range(2):
+        touch(op.join(src_dir, b"f"))
+        batch.move(op.join(src_dir, b"f"), location, src_dir_fd=batch.source_dir(op.join(src_dir, b"f")))
+    assert os.listdir(src_dir) == []
+    assert sorted(os.listdir(op.join(tmpdir_b, b"trash", b"files"))) == [b"f", b"f 1"]
+    # The source directory stays open for the following paths
+    assert batch.source_dir(op.join(src_dir, b"g")) is batch.source_dir(op.join(src_dir, b"f"))
+
+
+@pytest.mark.skipif(not send2trash.plat_other.USE_DIR_FD, reason="Requires dir_fd support")
+def test_plan_after_source_dir_swap(tmpdir_b):
+    src_dir = op.join(tmpdir_b, b"src")
+    os.mkdir(src_dir)
+    touch(op.join(src_dir, b"a"))
+    batch = send2trash.plat_other.TrashBatch()
+    [item] = batch.plan([op.join(src_dir, b"a")])
+    assert item.error is None
+    # Swapped for another directory, as if done by another process
+    os.rename(src_dir, op.join(tmpdir_b, b"old"))
+    os.mkdir(op.join(tmpdir_b, b"real"))
+    os.symlink(b"real", src_dir)
+    touch(op.join(tmpdir_b, b"real", b"b"))
+    [item] = batch.plan([op.join(src_dir, b"b")])
+    assert item.error is None
+    assert item.real_path == op.join(os.fsencode(op.realpath(tmpdir_b)), b"real", b"b")
+    assert os.fstat(item.src_dir_fd.fd).st_ino == os.stat(op.join(tmpdir_b, b"real")).st_ino
+
+
+def test_dryrun_plan_does_not_create_trash(gen_ext_vol):
+    from send2trash import dryrun
+
+    result = dryrun.plan([gen_ext_vol[2]])
+    assert not result.errors
+    [group] = result.groups.values()
+    assert group.dest_trash == op.join(gen_ext_vol[0].trash_topdir_b, b".Trash-" + str(os.getuid()).encode())
+    assert group.paths == [gen_ext_vol[2]]
+    assert not op.exists(group.dest_trash)
+    assert op.exists(gen_ext_vol[2])
@@ -0,0 +1,80 @@
+# encoding: utf-8
+import os
+import sys
+import pytest
+from os import path as op
+
+from send2trash import progress
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+from send2trash import plat_other  # noqa: E402
+
+
+def write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def test_metrics():
+    metrics = progress.Metrics()
+    metrics(progress.ProgressEvent(progress.STARTED, "a"))
+    metrics(progress.ProgressEvent(progress.PHASE, "a", phase=progress.RENAME, seconds=0.5))
+    metrics(progress.ProgressEvent(progress.FINISHED, "a"))
+    metrics(progress.ProgressEvent(progress.STARTED, "b"))
+    metrics(progress.ProgressEvent(progress.FINISHED, "b", error=PermissionError()))
+    data = metrics.as_dict()
+    assert (data["started"], data["succeeded"], data["failed"]) == (2, 1, 1)
+    assert data["phase_seconds"] == {progress.RENAME: 0.5}
+    assert data["errors"] == {"PermissionError": 1}
+    assert metrics.slowest == ("a", progress.RENAME, 0.5)
+
+
+def test_trashing_reports_error():
+    events = []
+    with pytest.raises(OSError):
+        with progress.trashing(events.append, "a"):
+            raise OSError("failed")
+    assert [event.kind for event in events] == [progress.STARTED, progress.PHASE, progress.FINISHED]
+    assert events[1].phase == progress.TRASH
+    assert isinstance(events[2].error, OSError)
+
+
+def test_batch_reports_phases_and_copies(tmpdir_b):
+    location = plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    src_dir = op.join(tmpdir_b, b"src")
+    os.makedirs(op.join(src_dir, b"tree"))
+    write(op.join(src_dir, b"file"), 10)
+    write(op.join(src_dir, b"tree", b"a"), 100)
+    write(op.join(src_dir, b"tree", b"b"), 1000)
+    events = []
+    batch = plat_other.TrashBatch(progress=events.append)
+    [item] = batch.plan([op.join(src_dir, b"file")])
+    batch.move_item(item, location)
+    [item] = batch.plan([op.join(src_dir, b"tree")])
+    batch.move_item(item, location, cross_dev=True)
+    phases = [(op.basename(event.path), event.phase) for event in events if event.kind == progress.PHASE]
+    assert phases == [
+        (b"file", progress.RESOLVE),
+        (b"file", progress.INFO),
+        (b"file", progress.RENAME),
+        (b"tree", progress.RESOLVE),
+        (b"tree", progress.INFO),
+        (b"tree", progress.COPY),
+    ]
+    assert sorted(event.bytes for event in events if event.kind == progress.COPIED) == [100, 1000]
+
+
+def test_send2trash_many_reports_each_path(tmpdir_b, monkeypatch):
+    location = plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    monkeypatch.setattr(plat_other.TrashCache, "lookup", lambda self, path, dev: location)
+    paths = [op.join(tmpdir_b, name) for name in (b"a", b"b", b"missing")]
+    write(paths[0], 1)
+    write(paths[1], 1)
+    metrics = progress.Metrics()
+    result = plat_other.send2trash_many(paths, workers=2, progress=metrics)
+    assert len(result.failed) == 1
+    assert (metrics.started, metrics.succeeded, metrics.failed) == (2, 2, 1)
+    assert metrics.phase_counts[progress.RESOLVE] == 3
+    assert metrics.phase_counts[progress.RENAME] == 2
@@ -39,3 +39,36 @@ def test_no_args(file):
     pytest.raises(SystemExit, trash_main, [])
     pytest.raises(SystemExit, trash_main, ["-v"])
     assert op.exists(file) is True
+
+
+@pytest.fixture
+def files(make_home_files):
+    return make_home_files(5)
+
+
+def test_from_file_null_separated(files, tmp_path, capsys):
+    listing = tmp_path / "listing"
+    listing.write_bytes(b"\0".join(os.fsencode(file) for file in files) + b"\0")
+    trash_main(["-0", "--from-file", str(listing), "--jobs", "2", "--stats"])
+    assert not any(op.exists(file) for file in files)
+    assert "5 trashed, 0 failed" in capsys.readouterr().err
+
+
+def test_keep_going(files, capsys):
+    missing = files[0] + "_missing"
+    with pytest.raises(SystemExit) as exc_info:
+        trash_main(["--keep-going", missing] + files)
+    assert exc_info.value.code == 1
+    assert not any(op.exists(file) for file in files)
+    assert capsys.readouterr().err
+
+
+def test_stop_at_first_error(files, capsys):
+    missing = files[0] + "_missing"
+    with pytest.raises(SystemExit) as exc_info:
+        trash_main(["--jobs", "4", files[0], missing] + files[1:])
+    assert exc_info.value.code == 1
+    assert not op.exists(files[0])
+    # Left alone, as the paths after the first error
+    assert all(op.exists(file) for file in files[1:])
+    assert capsys.readouterr().err
@@ -0,0 +1,56 @@
+# encoding: utf-8
+import os
+import sys
+import pytest
+from os import path as op
+
+from send2trash import tracing
+
+if sys.platform == "win32":
+    pytest.skip("Skipping non-windows tests", allow_module_level=True)
+
+from send2trash import plat_other  # noqa: E402
+
+
+def test_disabled_by_default():
+    assert tracing.span("phase") is tracing.NULL_SPAN
+    tracing.syscall("stat")
+
+
+def test_trace(tmpdir_b, monkeypatch):
+    location = plat_other.TrashLocation(op.join(tmpdir_b, b"trash"), tmpdir_b, 0)
+    monkeypatch.setattr(plat_other.TrashCache, "lookup", lambda self, path, dev: location)
+    paths = [op.join(tmpdir_b, name) for name in (b"a", b"b")]
+    for path in paths:
+        open(path, "wb").close()
+    with tracing.trace() as tracer:
+        plat_other.send2trash(paths)
+    assert tracing.span("phase") is tracing.NULL_SPAN
+
+    summary = tracer.summary()
+    for phase in ("resolve", "trash", "reserve_name", "write_info", "rename", "check_create"):
+        assert phase in summary["phases"]
+    assert summary["phases"]["trash"]["count"] == 2
+    for path in paths:
+        counts = summary["paths"][os.fsdecode(path)]
+        assert counts["rename"] == 1
+        assert counts["lstat"] >= 1
+
+    spans = tracer.spans()
+    by_id = {span["spanId"]: span for span in spans}
+    renames = [span for span in spans if span["name"] == "rename"]
+    assert len(renames) == 2
+    for span in renames:
+        assert span["attributes"]["send2trash.syscalls.rename"] == 1
+        assert by_id[span["parentSpanId"]]["name"] == "trash"
+        assert span["startTimeUnixNano"] <= span["endTimeUnixNano"]
+
+
+def test_span_error():
+    with tracing.trace() as tracer:
+        with pytest.raises(OSError):
+            with tracing.span("phase", "path"):
+                raise OSError("failed")
+    [span] = tracer.spans()
+    assert span["status"]["code"] == "STATUS_CODE_ERROR"
+    assert span["attributes"]["send2trash.path"] == "path"